@@ -0,0 +1,24 @@
+"""
+static/ のファイル (テーマの CSS・タイマー) の読み込み。
+
+中身とバージョン文字列はプロセスで1度だけ作る (スクリプトに置くと再実行のたびに cache_resource の
+関数キーを計算し直すことになるので、import されるこのモジュールに置く)。
+"""
+import hashlib
+import os
+
+import streamlit as st
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "app/static"
+
+@st.cache_resource
+def static_asset(name):
+    """静的ファイルの中身と、キャッシュ更新用のバージョン文字列"""
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        body = f.read()
+    return body, hashlib.sha1(body.encode("utf-8")).hexdigest()[:8]
+
+def static_url(name):
+    # 中身が変わったときだけ URL が変わるので、ブラウザはそれまでキャッシュを使える
+    return f"{STATIC_URL}/{name}?v={static_asset(name)[1]}"
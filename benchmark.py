@@ -0,0 +1,288 @@
+"""
+性能ベンチマーク。
+
+    python benchmark.py                    # 計測して benchmark_baseline.json と比較する
+    python benchmark.py --save-baseline    # 計測結果をベースラインとして保存する
+    python benchmark.py --sizes 1000 100000 --threshold 0.3
+
+ランキングの計測は一時ディレクトリに合成した ranking.csv (既定で 1k / 100k / 1M 行) に
+対して行うので、手元の ranking.csv には触れない。ベースラインより中央値が
+threshold 以上遅くなったケースがあれば終了コード 1 を返す。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+import streamlit.logger
+
+# st.* をスクリプト実行外で呼ぶと毎回警告が出るので抑える
+# (設定の読み込み時にログレベルが戻るので、先に読み込ませておく)
+st.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+import mental_math_app as app
+import questions
+import ranking
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = (1000, 100000, 1000000)
+MICRO_INNER = 50
+RANKING_MODES = ["お気軽(基礎)", "お気軽(上級)", "チャレンジ(基礎)", "チャレンジ(上級)"]
+
+
+# ==========================================
+# 計測
+# ==========================================
+def measure(fn, repeat, inner=1, warmup=1):
+    """
+    fn を repeat 回計測し、スループットとレイテンシのパーセンタイル (1回あたり) を返す。
+    数マイクロ秒の関数はタイマーの誤差に埋もれるので、inner 回まとめて1標本とする。
+    """
+    for _ in range(warmup * inner):
+        fn()
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            t0 = time.perf_counter_ns()
+            for _ in range(inner):
+                fn()
+            samples.append((time.perf_counter_ns() - t0) / inner)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return summarize(samples, repeat * inner)
+
+
+def summarize(samples, n=None):
+    """1回あたりの所要時間 (ナノ秒) の標本からスループットとパーセンタイルを求める"""
+    samples = sorted(samples)
+    total = sum(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] / 1000
+
+    return {
+        "n": len(samples) if n is None else n,
+        "ops_per_sec": len(samples) / (total / 1e9) if total else float("inf"),
+        "mean_us": statistics.fmean(samples) / 1000,
+        "p50_us": pct(50),
+        "p95_us": pct(95),
+        "p99_us": pct(99),
+    }
+
+
+def bench_generation(results, repeat):
+    random.seed(0)
+    cases = {
+        "generate_question_data[basic]": lambda: questions.generate_question_data(is_advanced=False, exclude_pattern=3),
+        "generate_question_data[advanced]": lambda: questions.generate_question_data(is_advanced=True),
+        "generate_question_data[advanced,pattern3]": lambda: questions.generate_question_data(is_advanced=True, force_pattern=3),
+    }
+    for name, fn in cases.items():
+        results[name] = measure(fn, repeat, MICRO_INNER)
+
+    sampler = questions.AdaptiveSampler()
+    for sc in questions._SCENARIO_TABLE:
+        sampler.update(sc["index"], random.random())
+    results["generate_question_data[advanced,adaptive]"] = measure(
+        lambda: questions.generate_question_data(is_advanced=True, sampler=sampler), repeat, MICRO_INNER)
+    results["AdaptiveSampler.update+pick"] = measure(
+        lambda: sampler.update(random.randrange(len(questions._SCENARIO_TABLE)), random.random()) or sampler.pick(), repeat, MICRO_INNER)
+
+    state = {}
+    results["generate_flashcard_data"] = measure(lambda: questions.generate_flashcard_data(state), repeat, MICRO_INNER)
+
+
+def bench_formatting(results, repeat):
+    rng = random.Random(0)
+    # キャッシュに当たらない値と、出題で繰り返し現れる値の両方を測る
+    calls = (repeat + 1) * MICRO_INNER
+    cold = [rng.randrange(1, questions.MAX_LIMIT) for _ in range(calls)]
+    hot = [questions.generate_question_data(is_advanced=True, rng=rng)["correct"] for _ in range(64)]
+    it = iter(cold)
+    results["format_japanese_answer[miss]"] = measure(lambda: questions.format_japanese_answer(next(it)), repeat, MICRO_INNER)
+    it_hot = iter(hot * (calls // len(hot) + 1))
+    results["format_japanese_answer[hit]"] = measure(lambda: questions.format_japanese_answer(next(it_hot)), repeat, MICRO_INNER)
+
+
+def bench_grading(results, repeat):
+    rng = random.Random(0)
+    pairs = []
+    for _ in range((repeat + 1) * MICRO_INNER):
+        correct = rng.randrange(10**4, 10**12)
+        pairs.append((int(correct * rng.uniform(0.5, 1.5)), correct))
+    it = iter(pairs)
+    results["calculate_score"] = measure(lambda: questions.calculate_score(*next(it)), repeat, MICRO_INNER)
+
+
+def write_synthetic_ranking(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "timestamp": "2024-01-01 12:00",
+        "nickname": np.char.add("user", rng.integers(0, 50000, rows).astype(str)),
+        "mode": np.asarray(RANKING_MODES)[rng.integers(0, len(RANKING_MODES), rows)],
+        "score": rng.integers(0, 201, rows),
+        "duration": np.round(rng.uniform(20, 600, rows), 2),
+    })
+    df.to_csv(path, index=False, columns=ranking.RANKING_COLUMNS)
+
+
+def bench_ranking(results, sizes):
+    saved = ranking.RANKING_FILE, ranking.RANKING_BACKEND
+    tmpdir = tempfile.mkdtemp(prefix="ranking_bench_")
+    ranking.RANKING_BACKEND = "csv"
+    try:
+        for rows in sizes:
+            ranking.RANKING_FILE = os.path.join(tmpdir, f"ranking_{rows}.csv")
+            write_synthetic_ranking(ranking.RANKING_FILE, rows)
+            ranking.invalidate_ranking_cache()
+            cold = max(3, min(50, 200000 // rows))
+
+            def load_cold():
+                ranking.invalidate_ranking_cache()
+                ranking.load_ranking()
+
+            def display_cold():
+                ranking.invalidate_ranking_cache()
+                app.display_ranking(RANKING_MODES[0])
+
+            results[f"load_ranking[{rows},cold]"] = measure(load_cold, cold)
+            results[f"load_ranking[{rows},warm]"] = measure(ranking.load_ranking, 200)
+            results[f"display_ranking[{rows},cold]"] = measure(display_cold, cold)
+            results[f"display_ranking[{rows},warm]"] = measure(lambda: app.display_ranking(RANKING_MODES[0]), 200)
+            results[f"save_ranking[{rows}]"] = measure(
+                lambda: ranking.save_ranking("bench", RANKING_MODES[1], random.randint(0, 200), 123.45), 200)
+    finally:
+        ranking.RANKING_FILE, ranking.RANKING_BACKEND = saved
+        ranking.invalidate_ranking_cache()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# 新しいプロセスで import と最初の描画 (ホーム画面) にかかる時間を測る
+STARTUP_SCRIPT = """
+import time
+t0 = time.perf_counter_ns()
+import mental_math_app
+t1 = time.perf_counter_ns()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(mental_math_app.__file__, default_timeout=120)
+t2 = time.perf_counter_ns()
+at.run()
+t3 = time.perf_counter_ns()
+assert not at.exception, at.exception
+print(t1 - t0, t3 - t2)
+"""
+
+
+def bench_startup(results, runs):
+    tmpdir = tempfile.mkdtemp(prefix="startup_bench_")
+    try:
+        # ホームのランキング表が描画されるように 1k 行のランキングを置いておく
+        write_synthetic_ranking(os.path.join(tmpdir, "ranking.csv"), 1000)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)), STREAMLIT_LOGGER_LEVEL="error")
+        imports, renders = [], []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=tmpdir, env=env,
+                                 capture_output=True, text=True, check=True).stdout.split()
+            imports.append(int(out[-2]))
+            renders.append(int(out[-1]))
+        results["startup[import]"] = summarize(imports)
+        results["startup[first_render]"] = summarize(renders)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run(sizes, repeat, startup_runs):
+    results = {}
+    if startup_runs:
+        bench_startup(results, startup_runs)
+    bench_generation(results, repeat)
+    bench_formatting(results, repeat)
+    bench_grading(results, repeat)
+    bench_ranking(results, sizes)
+    return {
+        "meta": {
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": list(sizes),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+# ==========================================
+# 報告・ベースライン比較
+# ==========================================
+def compare(current, baseline, threshold):
+    """ベースラインより p50 が threshold を超えて悪化したケース名の一覧を返す"""
+    regressions = []
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or base["p50_us"] <= 0:
+            continue
+        cur["baseline_p50_us"] = base["p50_us"]
+        cur["ratio"] = cur["p50_us"] / base["p50_us"]
+        if cur["ratio"] > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def report(current, regressions):
+    print(f"{'case':<45} {'ops/s':>12} {'p50(us)':>11} {'p95(us)':>11} {'p99(us)':>11} {'vs base':>8}")
+    for name, r in current["results"].items():
+        ratio = f"{r['ratio']:.2f}x" if "ratio" in r else "-"
+        flag = "  << REGRESSION" if name in regressions else ""
+        print(f"{name:<45} {r['ops_per_sec']:>12,.1f} {r['p50_us']:>11,.1f} {r['p95_us']:>11,.1f} {r['p99_us']:>11,.1f} {ratio:>8}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビジネス暗算道場 ベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="合成ランキングの行数")
+    parser.add_argument("--repeat", type=int, default=200, help=f"関数単位のケースの標本数 (1標本 = {MICRO_INNER} 回呼び出し)")
+    parser.add_argument("--startup-runs", type=int, default=5, help="起動時間を測る回数 (0 で測らない)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとして保存する")
+    parser.add_argument("--threshold", type=float, default=0.5, help="p50 がこの割合を超えて悪化したら回帰とみなす")
+    parser.add_argument("--json", help="結果を JSON で書き出すパス")
+    args = parser.parse_args(argv)
+
+    current = run(args.sizes, args.repeat, args.startup_runs)
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(current, json.load(f), args.threshold)
+    report(current, regressions)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"ベースラインを {args.baseline} に保存しました。")
+    elif regressions:
+        print(f"{len(regressions)} 件のケースがベースラインより {args.threshold:.0%} 以上遅くなっています。")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+ヘッドレスの負荷試験。AppTest で main() を実行し、多数のプレイヤーを模擬する。
+
+    python loadtest.py                              # 1プロセス x 20 セッション
+    python loadtest.py --workers 4 --sessions 25    # 4プロセスで同じ ranking.csv に書き込む
+    python loadtest.py --seed-rows 100000           # 10万行のランキングがある状態で測る
+    python loadtest.py --workers 4 --backend redis  # ranking_server.py を立てて4プロセスで共有する
+
+各プレイヤーは ホーム → お気軽/チャレンジ (基礎/上級) → 10問回答 → ランキング登録 → ホーム
+の流れを --games 回繰り返す。1プロセス内のセッションは1回の再実行ごとに順番に進める
+(AppTest は同時に1つしか実行できないため)。計測結果から、1プロセスが捌ける
+秒間再実行数と、プレイヤーが --think 秒に1回操作する場合の同時プレイヤー数の目安を出す。
+レイテンシには AppTest 自体の処理 (要素ツリーの組み立てなど) も含まれるので、
+実際のサーバーより大きめの値になる。
+
+ranking.csv / ranking.db は一時ディレクトリに作り、--backend redis ではこのプロセス内で
+ranking_server.py の代用サーバーを起動するので、手元のデータには触れない。
+"""
+import argparse
+import gc
+import multiprocessing as mp
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import fcntl
+    import resource
+except ImportError:  # Windows (ロック待ち・最大 RSS は計測しない)
+    fcntl = None
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mental_math_app.py")
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit")
+MODE_BUTTONS = ("quiz_basic_btn", "quiz_adv_btn", "train_basic_btn", "train_adv_btn")
+TOTAL_QUESTIONS = 10
+
+
+# ==========================================
+# プレイヤーの操作
+# ==========================================
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+def _answer_quiz(at, rng):
+    options = [b for b in at.button if b.key and "_opt_" in b.key]
+    rng.choice(options).click().run()
+
+def _answer_training(at, rng):
+    # 人間の概算らしく、正解の ±20% 程度の値を入力して答え合わせする
+    correct = at.session_state["quiz_data"]["correct"]
+    idx = at.session_state["current_q_idx"]
+    at.number_input(key=f"train_ans_{idx}").set_value(int(correct * rng.uniform(0.8, 1.2)))
+    _button(at, "答え合わせ").click().run()
+
+def player_steps(at, rng, games, player_id):
+    """1回の再実行ごとに (ラベル, 操作) を返すジェネレーター"""
+    yield "home", at.run
+    for _ in range(games):
+        mode = rng.choice(MODE_BUTTONS)
+        answer = _answer_quiz if mode.startswith("quiz") else _answer_training
+        yield "start", lambda: at.button(key=mode).click().run()
+        for _ in range(TOTAL_QUESTIONS):
+            yield "answer", lambda: answer(at, rng)
+            yield "next", lambda: _button(at, "次の問題へ").click().run()
+        yield "nickname", lambda: at.text_input(key="ranking_nickname").input(f"load{player_id}").run()
+        yield "register", lambda: _button(at, "登録する").click().run()
+        yield "home", lambda: _button(at, "トップに戻る").click().run()
+
+
+# ==========================================
+# ロック待ちの計測
+# ==========================================
+def _lock_name(fd):
+    try:
+        return os.path.basename(os.readlink(f"/proc/self/fd/{fd}"))
+    except OSError:  # /proc がない環境ではファイル名を区別しない
+        return "(lock)"
+
+def instrument_flock(stats):
+    """
+    fcntl.flock を差し替え、排他ロックがすぐ取れたか・何秒待ったかをロックファイルごとに数える。
+    ranking.py は fcntl.flock を呼ぶたびに属性を引くので、モジュール属性を置き換える。
+    """
+    real_flock = fcntl.flock
+
+    def flock(fd, op):
+        if op & fcntl.LOCK_EX and not op & fcntl.LOCK_NB:
+            s = stats.setdefault(_lock_name(fd), {"acquired": 0, "waits_ms": []})
+            try:
+                real_flock(fd, op | fcntl.LOCK_NB)
+                s["acquired"] += 1
+                return
+            except BlockingIOError:
+                pass
+            t0 = time.perf_counter()
+            real_flock(fd, op)
+            s["acquired"] += 1
+            s["waits_ms"].append((time.perf_counter() - t0) * 1000)
+        else:
+            real_flock(fd, op)
+
+    fcntl.flock = flock
+
+
+# ==========================================
+# ワーカー (1プロセス = 1サーバー相当)
+# ==========================================
+def flush_ranking_writers(timeout=60):
+    """
+    アプリのバックグラウンドの書き込みが終わるのを待つ (一時ディレクトリを消す前・計測の締めに)。
+    スレッドは ranking モジュールが最初の登録のときに起動するので、名前で探す (起動していなければ何もしない)。
+    """
+    for thread in threading.enumerate():
+        if thread.name == "ranking-writer":
+            thread.flush(timeout)
+
+def _new_session(AppTest):
+    return AppTest.from_file(APP_PATH, default_timeout=60)
+
+def _drive(players, rng, latencies, errors):
+    """生きているプレイヤーをランダムな順に1ステップずつ進める"""
+    active = list(players)
+    reruns = 0
+    while active:
+        player = rng.choice(active)
+        at, steps = player
+        try:
+            label, step = next(steps)
+        except StopIteration:
+            active.remove(player)
+            continue
+        t0 = time.perf_counter()
+        try:
+            step()
+        except Exception as e:  # 想定外の画面遷移なども記録して、そのプレイヤーは打ち切る
+            errors.append(f"{label}: {type(e).__name__}: {e}")
+            active.remove(player)
+            continue
+        latencies.setdefault(label, []).append((time.perf_counter() - t0) * 1000)
+        reruns += 1
+        if at.exception:
+            errors.append(f"{label}: {at.exception[0].value}")
+            active.remove(player)
+    return reruns
+
+def run_worker(worker_id, workdir, sessions, games, memory_sessions, seed, backend="csv", url=None):
+    os.chdir(workdir)
+    # 設定は ranking.py を最初に import したときに環境変数から読むので、アプリを動かす前に設定する
+    os.environ["RANKING_BACKEND"] = backend
+    if url:
+        os.environ["RANKING_URL"] = url
+    import streamlit as st
+    import streamlit.logger
+    from streamlit.testing.v1 import AppTest
+    # 設定の読み込み時にログレベルが戻るので、先に読み込ませてから警告を抑える
+    st.get_option("logger.level")
+    streamlit.logger.set_log_level("error")
+
+    flock_stats = {}  # {ロックファイル名: {"acquired": 取得回数, "waits_ms": [待ち時間]}}
+    if fcntl is not None:
+        instrument_flock(flock_stats)
+
+    rng = random.Random(seed * 1000 + worker_id)
+    latencies, errors = {}, []
+
+    players = []
+    for i in range(sessions):
+        at = _new_session(AppTest)
+        players.append((at, player_steps(at, rng, games, f"{worker_id}-{i}")))
+    t0 = time.perf_counter()
+    reruns = _drive(players, rng, latencies, errors)
+    flush_ranking_writers()
+    elapsed = time.perf_counter() - t0
+
+    # セッションあたりのメモリは、計測を有効にした状態で別のセッションを遊ばせて測る
+    # (tracemalloc は遅いので、レイテンシの計測中は止めておく)
+    memory = None
+    if memory_sessions:
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        extra = []
+        for i in range(memory_sessions):
+            at = _new_session(AppTest)
+            extra.append((at, player_steps(at, rng, 1, f"{worker_id}-m{i}")))
+        _drive(extra, rng, {}, errors)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory = {"per_session_kb": (current - base) / memory_sessions / 1024, "peak_kb": (peak - base) / 1024}
+        flush_ranking_writers()
+
+    return {
+        "worker": worker_id,
+        "reruns": reruns,
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "errors": errors,
+        "flock": flock_stats if fcntl is not None else None,
+        "memory": memory,
+        "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+    }
+
+
+# ==========================================
+# 集計
+# ==========================================
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))]
+    return {"n": len(values), "mean": statistics.fmean(values), "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": values[-1]}
+
+def report(results, think):
+    merged = {}
+    for r in results:
+        for label, values in r["latencies"].items():
+            merged.setdefault(label, []).extend(values)
+    all_values = [v for values in merged.values() for v in values]
+
+    print("再実行レイテンシ (ms)")
+    print(f"{'step':<10} {'n':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for label, values in list(merged.items()) + [("(all)", all_values)]:
+        if not values:
+            continue
+        s = percentiles(values)
+        print(f"{label:<10} {s['n']:>7} {s['mean']:>9.1f} {s['p50']:>9.1f} {s['p95']:>9.1f} {s['p99']:>9.1f} {s['max']:>9.1f}")
+
+    print()
+    for r in results:
+        rate = r["reruns"] / r["elapsed"] if r["elapsed"] else 0
+        line = f"worker {r['worker']}: {r['reruns']} 回 / {r['elapsed']:.1f} 秒 = {rate:.1f} 回/秒"
+        line += f" (同時プレイヤー目安 {rate * think:.0f} 人, {think:g} 秒に1操作として)"
+        if r["maxrss_kb"]:
+            line += f", maxrss {r['maxrss_kb'] / 1024:.0f} MB"
+        print(line)
+        if r["memory"]:
+            print(f"  メモリ: 1セッションあたり {r['memory']['per_session_kb']:.0f} KB 保持, ピーク +{r['memory']['peak_kb']:.0f} KB")
+
+    flocks = [r["flock"] for r in results if r["flock"] is not None]
+    for name in sorted({name for f in flocks for name in f}):
+        acquired = sum(f[name]["acquired"] for f in flocks if name in f)
+        waits = [w for f in flocks if name in f for w in f[name]["waits_ms"]]
+        line = f"{name} ロック: {acquired} 回取得, うち {len(waits)} 回待ち"
+        if waits:
+            s = percentiles(waits)
+            line += f" (待ち時間 p50 {s['p50']:.2f} ms / p99 {s['p99']:.2f} ms / 最大 {s['max']:.2f} ms)"
+        print(line)
+
+    errors = [e for r in results for e in r["errors"]]
+    if errors:
+        print(f"\nエラー {len(errors)} 件:")
+        for e in errors[:10]:
+            print("  " + e)
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビジネス暗算道場 負荷試験")
+    parser.add_argument("--workers", type=int, default=1, help="サーバープロセス数 (ranking.csv を共有する)")
+    parser.add_argument("--sessions", type=int, default=20, help="1プロセスあたりの同時セッション数")
+    parser.add_argument("--games", type=int, default=1, help="1セッションあたりのプレイ回数")
+    parser.add_argument("--memory-sessions", type=int, default=5, help="メモリ計測に使う追加セッション数 (0 で計測しない)")
+    parser.add_argument("--seed-rows", type=int, default=0, help="開始時にランキングに入れておく合成行数")
+    parser.add_argument("--backend", choices=["csv", "sqlite", "redis"], default="csv", help="ランキングの保存先")
+    parser.add_argument("--think", type=float, default=5.0, help="プレイヤーが1操作にかける秒数 (同時人数の目安の計算用)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    server = url = None
+    try:
+        if os.path.isdir(CONFIG_DIR):
+            shutil.copytree(CONFIG_DIR, os.path.join(workdir, ".streamlit"))
+        if args.backend == "redis":
+            import ranking_server
+            server = ranking_server.serve_in_thread()
+            url = ranking_server.server_url(server)
+        if args.seed_rows:
+            import benchmark
+            import ranking
+            csv_path = os.path.join(workdir, "ranking.csv")
+            benchmark.write_synthetic_ranking(csv_path, args.seed_rows, args.seed)
+            if args.backend != "csv":
+                ranking.RANKING_DB = os.path.join(workdir, "ranking.db")
+                ranking.RANKING_URL = url
+                ranking.migrate_ranking_csv(csv_path, args.backend)
+
+        jobs = [(w, workdir, args.sessions, args.games, args.memory_sessions, args.seed, args.backend, url)
+                for w in range(args.workers)]
+        if args.workers == 1:
+            results = [run_worker(*jobs[0])]
+        else:
+            with mp.get_context("spawn").Pool(args.workers) as pool:
+                results = pool.starmap(run_worker, jobs)
+        return report(results, args.think)
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,418 +1,187 @@
 import streamlit as st
-import random
 import time
-import pandas as pd
 import os
+from contextlib import contextmanager
 from datetime import datetime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+_SCRIPT_T0 = time.perf_counter()  # 起動時間の計測用 (スクリプトは再実行のたびにここから実行される)
+
+# 出題・ランキング・計測・統計の状態と処理は別モジュールに置く。import したモジュールは再実行のたびに
+# 読み直されないので、ここ (再実行ごとに実行されるスクリプト) には画面の処理だけを残す
+from assets import static_asset, static_url
+from metrics import METRICS, METRICS_FILE, dump_profile, start_profile
+from questions import (TOTAL_QUESTIONS, AdaptiveSampler, build_explanation, build_quiz_options, cached_regrade_attempts,
+                       calculate_score, format_japanese_answer, generate_flashcard_data, generate_question_data,
+                       get_daily_challenge, get_mental_math_tip, is_choice_correct)
+from ranking import DAILY_MODES, RANKING_COLUMNS, RANKING_PAGE_SIZE, daily_mode_name, ranking_count, ranking_top, submit_ranking
+from stats import STATS_SNAPSHOT_INTERVAL, StatAggregate, add_answer_stats, merged_answer_stats, record_attempt, record_nickname_stats
 
 # ==========================================
 # 定数・設定
 # ==========================================
-RANKING_FILE = "ranking.csv"
-MAX_LIMIT = 10**13
-TOTAL_QUESTIONS = 10
+ADMIN_DEBUG = os.environ.get("ADMIN_DEBUG") == "1"  # サイドバーにメトリクスを表示する
+
+# ==========================================
+# 計測 (メトリクス)
+# ==========================================
+def _payload_counter(ctx):
+    # 送信キューを1度だけ包み、送ったメッセージのバイト数を数える
+    counter = getattr(ctx, "_payload_counter", None)
+    if counter is None:
+        enqueue = ctx._enqueue
+        counter = {"bytes": 0, "active": False}
+        def counting_enqueue(msg):
+            counter["bytes"] += msg.ByteSize()
+            enqueue(msg)
+        ctx._enqueue = counting_enqueue
+        ctx._payload_counter = counter
+    return counter
+
+@contextmanager
+def script_metrics(page, scope):
+    """
+    再実行1回分の所要時間と送信サイズを記録し、PROFILE_DIR があればプロファイルも書き出す。
+    ページ全体の実行の中で呼ばれたフラグメントは二重に数えないよう記録しない。
+    """
+    ctx = get_script_run_ctx()
+    counter = _payload_counter(ctx) if ctx is not None and hasattr(ctx, "_enqueue") else None
+    if counter is not None and counter["active"]:
+        yield
+        return
+    if counter is not None:
+        counter["bytes"] = 0
+        counter["active"] = True
+    profiler = start_profile()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe("mental_math_script_seconds", time.perf_counter() - t0, page=page, scope=scope)
+        if counter is not None:
+            counter["active"] = False
+            METRICS.observe("mental_math_payload_bytes", counter["bytes"], page=page, scope=scope)
+        if profiler is not None:
+            dump_profile(profiler, page, scope)
+        if METRICS_FILE:
+            METRICS.flush(METRICS_FILE)
 
 # ==========================================
 # デザイン設定 (CSS)
 # ==========================================
 def apply_custom_design():
-    custom_css = """
-    <style>
-        .stApp {
-            background-color: #0F172A;
-            color: #F8FAFC;
-        }
-        h1, h2, h3 {
-            color: #38BDF8;
-            font-family: "Roboto", "Helvetica Neue", sans-serif;
-            font-weight: 700;
-            letter-spacing: 0.05em;
-        }
-        /* プライマリーボタン */
-        div.stButton > button:first-child {
-            background: linear-gradient(135deg, #2563EB 0%, #1E3A8A 100%);
-            color: white;
-            border-radius: 4px;
-            border: none;
-            box-shadow: 0 4px 15px rgba(37, 99, 235, 0.4);
-            font-weight: bold;
-            letter-spacing: 0.05em;
-            transition: all 0.2s ease-in-out;
-        }
-        div.stButton > button:first-child:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 20px rgba(37, 99, 235, 0.6);
-        }
-        /* セカンダリーボタン（透明） */
-        div.stButton > button:nth-child(2) {
-            background-color: transparent;
-            color: #38BDF8;
-            border: 1px solid #38BDF8;
-            border-radius: 4px;
-        }
-        div.stButton > button:nth-child(2):hover {
-            background-color: rgba(56, 189, 248, 0.1);
-        }
-        [data-testid="stMetricValue"] {
-            color: #FACC15;
-            font-family: 'Consolas', 'Monaco', monospace;
-            font-weight: bold;
-            text-shadow: 0 0 10px rgba(250, 204, 21, 0.3);
-        }
-        [data-testid="stMetricLabel"] {
-            color: #94A3B8;
-        }
-        .css-card {
-            background-color: #1E293B;
-            border-left: 4px solid #FACC15;
-            padding: 20px;
-            border-radius: 6px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.3);
-            margin-bottom: 20px;
-        }
-        .flashcard-q {
-            font-size: 42px; 
-            font-weight: bold; 
-            color: #F8FAFC; 
-            text-align: center;
-            font-family: 'Consolas', 'Monaco', monospace;
-            padding: 40px 0;
-        }
-        .flashcard-a {
-            font-size: 42px; 
-            font-weight: bold; 
-            color: #FACC15; 
-            text-align: center;
-            padding: 20px 0;
-            border-top: 1px dashed #334155;
-        }
-        .stAlert {
-            background-color: #1E293B;
-            border: 1px solid #334155;
-            color: #E2E8F0;
-        }
-        hr {
-            border-color: #334155;
-        }
-        /* 履歴テーブル用のスタイル */
-        .history-row {
-            background-color: #1E293B;
-            padding: 10px;
-            margin-bottom: 8px;
-            border-radius: 4px;
-            border-left: 3px solid #38BDF8;
-            font-size: 14px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        /* タブのスタイル調整 */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 10px;
-        }
-        .stTabs [data-baseweb="tab"] {
-            height: 50px;
-            white-space: pre-wrap;
-            background-color: #1E293B;
-            border-radius: 4px 4px 0 0;
-            color: #94A3B8;
-        }
-        .stTabs [aria-selected="true"] {
-            background-color: #38BDF8 !important;
-            color: #0F172A !important;
-            font-weight: bold;
-        }
-    </style>
-    """
-    st.markdown(custom_css, unsafe_allow_html=True)
+    # 静的配信が有効なら <link> だけを送る (CSS 本体はブラウザにキャッシュされる)
+    if st.get_option("server.enableStaticServing"):
+        st.markdown(f'<link rel="stylesheet" href="{static_url("theme.css")}">', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>\n{static_asset('theme.css')[0]}</style>", unsafe_allow_html=True)
 
 # ==========================================
 # ランキング機能
 # ==========================================
-def load_ranking():
-    if not os.path.exists(RANKING_FILE):
-        return pd.DataFrame(columns=["timestamp", "nickname", "mode", "score", "duration"])
-    return pd.read_csv(RANKING_FILE)
-
-def save_ranking(nickname, mode, score, duration):
-    df = load_ranking()
-    new_data = pd.DataFrame({
-        "timestamp": [datetime.now().strftime("%Y-%m-%d %H:%M")],
-        "nickname": [nickname],
-        "mode": [mode],
-        "score": [score],
-        "duration": [duration]
-    })
-    df = pd.concat([df, new_data], ignore_index=True)
-    df.to_csv(RANKING_FILE, index=False)
-
-def display_ranking(filter_mode=None):
-    df = load_ranking()
-    if df.empty:
-        st.info("まだランキングデータがありません。")
-        return
+def format_durations(durations):
+    """秒数の Series を「X分Y秒」にまとめて変換する"""
+    return (durations // 60).astype(int).astype(str) + "分" + (durations % 60).astype(int).astype(str) + "秒"
 
-    if filter_mode:
-        df = df[df["mode"] == filter_mode]
-        if df.empty:
+def display_ranking(filter_mode=None, around_rank=None):
+    """
+    ランキングを1ページ分だけ取り出して表示する。around_rank を渡すとその順位の周辺を表示する。
+    """
+    import pandas as pd  # 表を出すページでだけ読み込む
+    total = ranking_count(filter_mode)
+    if total == 0:
+        if filter_mode:
             st.info(f"ランキングデータはまだありません。")
-            return
+        else:
+            st.info("まだランキングデータがありません。")
+        return
 
-    df = df.sort_values(by=["score", "duration"], ascending=[False, True]).reset_index(drop=True)
-    
-    display_df = df[["nickname", "score", "duration", "timestamp"]].copy()
-    display_df["rank"] = display_df.index + 1
-    display_df["duration"] = display_df["duration"].apply(lambda x: f"{int(x//60)}分{int(x%60)}秒")
-    display_df.columns = ["ニックネーム", "スコア/正解数", "タイム", "日付", "順位"]
-    display_df = display_df[["順位", "ニックネーム", "スコア/正解数", "タイム", "日付"]]
+    pages = (total - 1) // RANKING_PAGE_SIZE + 1
+    offset = 0
+    if around_rank is not None and st.toggle("自分の順位の周辺を表示", value=True, key=f"ranking_around_{filter_mode}"):
+        offset = max(0, min(around_rank - 1 - RANKING_PAGE_SIZE // 2, total - RANKING_PAGE_SIZE))
+    elif pages > 1:
+        page = st.number_input(f"ページ (全{pages}ページ / {total}件)", min_value=1, max_value=pages, value=1, step=1, key=f"ranking_page_{filter_mode}")
+        offset = (page - 1) * RANKING_PAGE_SIZE
+
+    df = pd.DataFrame(ranking_top(filter_mode, RANKING_PAGE_SIZE, offset), columns=RANKING_COLUMNS)
+    display_df = pd.DataFrame({
+        "順位": range(offset + 1, offset + 1 + len(df)),
+        "ニックネーム": df["nickname"],
+        "スコア/正解数": df["score"],
+        "タイム": format_durations(df["duration"]),
+        "日付": df["timestamp"],
+    })
 
     st.dataframe(display_df, use_container_width=True, hide_index=True)
 
-# ==========================================
-# 共通関数: 数値フォーマット・生成
-# ==========================================
-def format_japanese_answer(num):
-    try:
-        int_num = int(num)
-    except:
-        return str(num)
-    if int_num == 0: return "0"
-    units = [(10**12, "兆"), (10**8, "億"), (10**4, "万"), (1, "")]
-    result = []
-    remaining = abs(int_num)
-    for unit_val, unit_name in units:
-        if remaining >= unit_val:
-            val = remaining // unit_val
-            remaining %= unit_val
-            result.append(f"{val:,}{unit_name}")
-    return "".join(result) if result else "0"
-
-def format_number_with_unit_label(value):
-    if value >= 10**8:
-        if value % 10**8 == 0: return f"{value // 10**8:,}億"
-        else: return f"{value / 10**8:.1f}億".replace(".0", "")
-    elif value >= 10**4:
-        if value % 10**4 == 0: return f"{value // 10**4:,}万"
-        else: return f"{value / 10**4:.1f}万".replace(".0", "")
-    else:
-        return f"{value:,}"
-
-def get_random_val(min_val, max_val, simple=False):
-    val = random.randint(min_val, max_val)
-    if simple:
-        digits = len(str(val))
-        if digits > 1:
-            bases = [10, 20, 30, 40, 50, 60, 70, 80, 90, 15, 25, 12, 18]
-            base = random.choice(bases)
-            min_digits = len(str(min_val))
-            target_digits = random.randint(min_digits, len(str(max_val)))
-            power = max(0, target_digits - 2)
-            val = base * (10**power)
-            if val < min_val: val = min_val
-            if val > max_val: val = max_val
-            if val < 100: val = (val // 10) * 10
-    return int(val)
-
-def get_mental_math_tip(pattern):
-    """
-    問題パターンに応じた暗算のコツを返す
-    """
-    common_tips = [
-        "💡 **コツ:** 数字の「0」を一旦無視して、ゼロ以外の数字同士を掛け算しましょう。最後に無視した0の個数を合計して付け足すと簡単です。",
-        "💡 **コツ:** 「万」は0が4つ、「億」は0が8つです。単位を0に置き換えて桁数を整理してみましょう。",
-        "💡 **コツ:** 概算の場合、有効数字（上1〜2桁）だけで計算し、あとは桁数を合わせるのがスピードアップの鍵です。",
-        "💡 **コツ:** 3桁ごとのカンマ「,」の位置を意識しましょう。1,000(千)、1,000,000(百万)、1,000,000,000(十億)が区切りです。"
-    ]
-    
-    pct_tips = [
-        "💡 **コツ:** 10%は「桁を1つ減らす」、1%は「桁を2つ減らす」ことと同じです。これを基準に倍数で考えましょう。",
-        "💡 **コツ:** 5%は「10%の半分」、20%は「10%の2倍」と考えると計算が早くなります。",
-        "💡 **コツ:** ×0.5 (50%) は「半分にする（÷2）」、×0.25 (25%) は「半分の半分（÷4）」と同じです。",
-        "💡 **コツ:** 「70%」などは「100% - 30%」と考えたほうが引き算で早く解ける場合があります。"
-    ]
-    
-    # パターン2, 3は%が含まれる
-    if pattern in [2, 3]:
-        return random.choice(common_tips + pct_tips)
-    else:
-        return random.choice(common_tips)
+@st.fragment
+def ranking_tabs():
+    """ホームのランキングタブ。ページ切り替えなどはこの部分だけを再実行する"""
+    with script_metrics("home", "fragment"):
+        _ranking_tabs()
 
-# ==========================================
-# シナリオデータ定義
-# ==========================================
-SCENARIOS = [
-    # パターン1: A * B
-    { "pattern": 1, "template": "単価 <b>{label1}円</b> の商品が <b>{label2}個</b> 売れました。<br>売上推定値は？", "range1": (100, 50000), "range2": (100, 100000), "unit1":"円", "unit2":"個" },
-    { "pattern": 1, "template": "1人あたり <b>{label1}円</b> のコストがかかる研修に <b>{label2}人</b> が参加します。<br>総費用推定値は？", "range1": (5000, 200000), "range2": (10, 5000), "unit1":"円", "unit2":"人" },
-    { "pattern": 1, "template": "月商 <b>{label1}円</b> の店舗を <b>{label2}店舗</b> 運営しています。<br>全店の月商合計は？", "range1": (1000000, 50000000), "range2": (3, 1000), "unit1":"円", "unit2":"店舗" },
-    { "pattern": 1, "template": "契約単価 <b>{label1}円</b> のサブスク会員が <b>{label2}人</b> います。<br>毎月の売上は？", "range1": (500, 10000), "range2": (1000, 1000000), "unit1":"円", "unit2":"人" },
-    # パターン2: A * r
-    { "pattern": 2, "template": "売上高 <b>{label1}円</b> に対して、営業利益率は <b>{pct}%</b> です。<br>営業利益は？", "range1": (100000000, 1000000000000), "pct_range": (1, 30), "unit1":"円" },
-    { "pattern": 2, "template": "市場規模 <b>{label1}円</b> の業界で、シェア <b>{pct}%</b> を獲得しました。<br>自社の売上は？", "range1": (1000000000, 1000000000000), "pct_range": (1, 60), "unit1":"円" },
-    { "pattern": 2, "template": "予算 <b>{label1}円</b> のうち、すでに <b>{pct}%</b> を消化しました。<br>消化した金額は？", "range1": (1000000, 1000000000), "pct_range": (5, 95), "unit1":"円" },
-    { "pattern": 2, "template": "投資額 <b>{label1}円</b> に対して、リターン（利回り）が <b>{pct}%</b> ありました。<br>利益額は？", "range1": (1000000, 10000000000), "pct_range": (3, 20), "unit1":"円" },
-    # パターン3: A * B * r
-    { "pattern": 3, "template": "単価 <b>{label1}円</b> の商品を <b>{label2}個</b> 販売し、利益率は <b>{pct}%</b> でした。<br>利益額は？", "range1": (100, 20000), "range2": (100, 50000), "pct_range": (5, 40), "unit1":"円", "unit2":"個" },
-    { "pattern": 3, "template": "客単価 <b>{label1}円</b> で <b>{label2}人</b> が来店し、原価率は <b>{pct}%</b> です。<br>原価の総額は？", "range1": (500, 10000), "range2": (100, 50000), "pct_range": (20, 80), "unit1":"円", "unit2":"人" },
-    { "pattern": 3, "template": "案件単価 <b>{label1}円</b> の案件が <b>{label2}件</b> あり、成約率は <b>{pct}%</b> でした。<br>成約による売上合計は？", "range1": (100000, 5000000), "range2": (10, 500), "pct_range": (5, 60), "unit1":"円", "unit2":"件" },
-    # パターン4: A * B(年)
-    { "pattern": 4, "template": "子会社株式の減損テスト。将来CF <b>{label1}円</b> が <b>{label2}</b> 続くと仮定します。<br>割引前のCF総額は？", "range1": (10000000, 5000000000), "range2": (3, 15), "suffix2": "年", "unit1":"円", "unit2":"年間" },
-    { "pattern": 4, "template": "投資案件の評価。年間 <b>{label1}円</b> のリターンが <b>{label2}</b> 継続する見込みです。<br>期間累計のリターンは？", "range1": (1000000, 1000000000), "range2": (3, 20), "suffix2": "年", "unit1":"円", "unit2":"年間" },
-    { "pattern": 4, "template": "新規事業のPL計画。年間固定費 <b>{label1}円</b> が <b>{label2}</b> かかる見通しです。<br>固定費の総額は？", "range1": (5000000, 500000000), "range2": (2, 5), "suffix2": "年", "unit1":"円", "unit2":"年間" }
-]
-
-def generate_question_data(is_advanced=False, force_pattern=None, simple_amounts=None, simple_pct=None):
-    if simple_amounts is None: simple_amounts = not is_advanced
-    if simple_pct is None: simple_pct = not is_advanced
-
-    if force_pattern:
-        candidates = [s for s in SCENARIOS if s['pattern'] == force_pattern]
-    else:
-        candidates = SCENARIOS
-        
-    scenario = random.choice(candidates)
-    pattern = scenario['pattern']
-    
-    val1 = get_random_val(scenario['range1'][0], scenario['range1'][1], simple=simple_amounts)
-    val2 = 1
-    pct = 0
-    
-    if 'range2' in scenario:
-        val2 = get_random_val(scenario['range2'][0], scenario['range2'][1], simple=simple_amounts)
-        
-    if 'pct_range' in scenario:
-        min_p, max_p = scenario['pct_range']
-        excluded_pct = [10, 50]
-        if simple_pct:
-            candidates_pct = list(range(min_p, max_p+1, 5))
-            candidates_pct = [p for p in candidates_pct if p not in excluded_pct and p != 0]
-            if not candidates_pct: pct = 5
-            else: pct = random.choice(candidates_pct)
-        else:
-            while True:
-                pct = random.randint(min_p, max_p)
-                if pct not in excluded_pct: break
-    
-    # 基礎編は単位付き、上級編はカンマ区切り
-    if simple_amounts:
-        label1 = format_number_with_unit_label(val1)
-    else:
-        label1 = f"{val1:,}"
+def _ranking_tabs():
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["お気軽(基礎)", "お気軽(上級)", "チャレンジ(基礎)", "チャレンジ(上級)", "デイリー"])
     
-    label2 = ""
-    suffix2 = scenario.get('suffix2', '')
-    
-    if pattern in [1, 3]:
-        if simple_amounts:
-            label2 = format_number_with_unit_label(val2)
-        else:
-            label2 = f"{val2:,}"
-    elif pattern == 4:
-        label2 = f"{val2}{suffix2}"
-        
-    correct_val = 0
-    if pattern == 1: correct_val = val1 * val2
-    elif pattern == 2: correct_val = val1 * (pct / 100.0)
-    elif pattern == 3: correct_val = val1 * val2 * (pct / 100.0)
-    elif pattern == 4: correct_val = val1 * val2
-
-    q_text = scenario['template'].format(label1=label1, label2=label2, pct=pct)
-    
-    unit1 = scenario.get('unit1', '')
-    unit2 = scenario.get('unit2', '')
-    if pattern == 4: unit2 = suffix2
-    
-    return {
-        "q_text": q_text,
-        "correct": correct_val,
-        "pattern": pattern,
-        "raw_val1": val1, "raw_val2": val2, "raw_pct": pct,
-        "unit1": unit1, "unit2": unit2,
-        "is_advanced": is_advanced
-    }
+    with tab1:
+        st.caption("お気軽モード（基礎編）")
+        display_ranking("お気軽(基礎)")
+    with tab2:
+        st.caption("お気軽モード（上級編）")
+        display_ranking("お気軽(上級)")
+    with tab3:
+        st.caption("チャレンジモード（基礎編）")
+        display_ranking("チャレンジ(基礎)")
+    with tab4:
+        st.caption("チャレンジモード（上級編）")
+        display_ranking("チャレンジ(上級)")
+    with tab5:
+        today = datetime.now().strftime("%Y-%m-%d")
+        for page in DAILY_MODES:
+            st.caption(daily_mode_name(page, today))
+            display_ranking(daily_mode_name(page, today))
+
+@st.fragment
+def ranking_panel(mode_name, rank):
+    with script_metrics(st.session_state.page, "fragment"):
+        display_ranking(filter_mode=mode_name, around_rank=rank)
 
 # ==========================================
-# フラッシュカード用データ生成
+# 出題の重み付け (苦手なシナリオを多めに出す)
 # ==========================================
-def generate_flashcard_data():
-    if 'flash_history' not in st.session_state:
-        st.session_state.flash_history = []
+def session_sampler():
+    # ゲームをまたいで同じセッションの解答結果を引き継ぐ
+    if "adaptive_sampler" not in st.session_state:
+        st.session_state.adaptive_sampler = AdaptiveSampler()
+    return st.session_state.adaptive_sampler
 
-    while True:
-        p1 = random.randint(2, 10) 
-        p2 = random.randint(2, 10) 
-        
-        if p1 + p2 > 13: 
-            continue
-            
-        val1 = 10**p1
-        val2 = 10**p2
-        
-        def to_label(v):
-            if v >= 10**8:
-                if v % 10**8 == 0: return f"{v//10**8}億"
-                else: return f"{v//10**8}億{v%10**8}..."
-            elif v >= 10**4:
-                if v % 10**4 == 0: return f"{v//10**4}万"
-            return f"{v:,}"
-            
-        l1 = to_label(val1)
-        l2 = to_label(val2)
-        q_text = f"{l1} × {l2}"
-        
-        if q_text in st.session_state.flash_history:
-            continue
-            
-        st.session_state.flash_history.append(q_text)
-        if len(st.session_state.flash_history) > 10:
-            st.session_state.flash_history.pop(0)
-            
-        return {
-            "q_text": q_text,
-            "correct": val1 * val2
-        }
+def update_session_sampler(q, miss):
+    if "scenario" in q:
+        session_sampler().update(q["scenario"], miss)
 
 # ==========================================
 # タイマー表示 (JavaScript)
 # ==========================================
 def show_timer():
-    timer_html = """
-    <div style="font-size:20px; color:#FACC15; font-weight:bold; margin-bottom:10px; font-family:monospace;">
-        ⏱️ Time: <span id="time_display">0.0</span>s
-    </div>
-    <script>
-        let start = Date.now();
-        let timer = setInterval(function() {
-            let delta = Date.now() - start;
-            let el = document.getElementById("time_display");
-            if(el) {
-                el.innerHTML = (delta / 1000).toFixed(1);
-            }
-        }, 100);
-    </script>
-    """
-    st.components.v1.html(timer_html, height=50)
+    if st.get_option("server.enableStaticServing"):
+        # st.iframe は "/" で始まる文字列だけを URL として扱うので、baseUrlPath を含めた絶対パスにする。
+        # 問題番号はハッシュで渡す。iframe は再読み込みされず、タイマーだけリセットされる
+        base = st.get_option("server.baseUrlPath").strip("/")
+        st.iframe(f"/{base + '/' if base else ''}{static_url('timer.html')}#q{st.session_state.current_q_idx}", height=50)
+    else:
+        st.iframe(static_asset("timer.html")[0], height=50)
 
 # ==========================================
-# スコア計算
+# 統計 (パターン別・モード別・ニックネーム別の逐次集計)
 # ==========================================
-def calculate_score(user_val, correct_val):
-    if correct_val == 0: return 0, 0.0, False
-    diff_pct = abs((user_val - correct_val) / correct_val * 100)
-    is_perfect = (user_val == correct_val)
-    points = 0
-    if diff_pct <= 2: points = 10
-    elif diff_pct <= 4: points = 9
-    elif diff_pct <= 6: points = 8
-    elif diff_pct <= 8: points = 7
-    elif diff_pct <= 10: points = 6
-    elif diff_pct <= 12: points = 5
-    elif diff_pct <= 14: points = 4
-    elif diff_pct <= 16: points = 3
-    elif diff_pct <= 18: points = 2
-    elif diff_pct <= 20: points = 1
-    else: points = 0
-    return points, diff_pct, is_perfect
+PATTERN_LABELS = {1: "A×B", 2: "A×r", 3: "A×B×r", 4: "A×B(年)"}
+MODE_LABELS = {"quiz": "お気軽(基礎)", "quiz_advanced": "お気軽(上級)", "training": "チャレンジ(基礎)", "training_advanced": "チャレンジ(上級)", **DAILY_MODES}
+
+def record_answer_stats(page, pattern, diff_pct, correct, elapsed):
+    """解答1件をプロセスの集計 (パターン別・モード別) とこのセッションの集計に足す"""
+    add_answer_stats(page, pattern, diff_pct, correct, elapsed)
+    st.session_state.setdefault("session_stats", StatAggregate()).update(diff_pct, correct, elapsed)
 
 # ==========================================
 # ゲーム進行管理
@@ -427,6 +196,7 @@ def init_game_state():
     st.session_state.quiz_data = None
     st.session_state.quiz_answered = False
     st.session_state.history = []
+    st.session_state.session_stats = StatAggregate()
     st.session_state.ranked_in = False
     st.session_state.flash_state = "question"
 
@@ -439,6 +209,48 @@ def next_question():
         st.session_state.quiz_answered = False
         st.session_state.current_start_time = time.time()
 
+# ------------------------------------------
+# ボタンのコールバック
+# コールバックはスクリプト実行の前に呼ばれるので、再実行を強制しなくても
+# 1回の実行で変更後の状態が画面に反映される
+# ------------------------------------------
+def go_to(page):
+    st.session_state.page = page
+
+def start_game(page):
+    init_game_state()
+    if page in DAILY_MODES:
+        st.session_state.daily_day = datetime.now().strftime("%Y-%m-%d")
+    st.session_state.page = page
+
+def stop_timer():
+    elapsed = time.time() - st.session_state.current_start_time
+    st.session_state.total_duration += elapsed
+    st.session_state.current_q_time = elapsed
+    st.session_state.quiz_answered = True
+
+def submit_choice(opt):
+    stop_timer()
+    st.session_state.user_choice = opt
+
+def advance_question(points, is_perfect=False):
+    st.session_state.score += points
+    if is_perfect: st.session_state.exact_matches += 1
+    next_question()
+
+def register_ranking(mode_name):
+    nickname = st.session_state.get("ranking_nickname") or "名無しさん"
+    st.session_state.my_rank = submit_ranking(nickname, mode_name, st.session_state.score, st.session_state.total_duration)
+    record_nickname_stats(nickname, st.session_state.get("session_stats") or StatAggregate())
+    st.session_state.ranked_in = True
+
+def show_flash_answer():
+    st.session_state.flash_state = "answer"
+
+def next_flashcard():
+    st.session_state.quiz_data = None
+    st.session_state.flash_state = "question"
+
 # ==========================================
 # 結果画面共通処理
 # ==========================================
@@ -461,16 +273,13 @@ def show_result_screen(mode_name):
         with st.container():
             st.markdown("### 🏆 ランキングに登録")
             c1, c2 = st.columns([3, 1])
-            nickname = c1.text_input("ニックネームを入力", placeholder="名無しさん")
-            if c2.button("登録する", type="primary"):
-                if not nickname: nickname = "名無しさん"
-                save_ranking(nickname, mode_name, st.session_state.score, st.session_state.total_duration)
-                st.session_state.ranked_in = True
-                st.rerun()
+            c1.text_input("ニックネームを入力", placeholder="名無しさん", key="ranking_nickname")
+            c2.button("登録する", type="primary", on_click=register_ranking, args=(mode_name,))
     else:
-        st.success("ランキングに登録しました！")
+        rank, total = st.session_state.my_rank
+        st.success(f"ランキングに登録しました！ ({total}人中 {rank}位)")
         st.markdown(f"### 📊 {mode_name} のランキング")
-        display_ranking(filter_mode=mode_name)
+        ranking_panel(mode_name, rank)
 
     st.markdown("---")
     st.write("### 📝 結果詳細")
@@ -487,44 +296,51 @@ def show_result_screen(mode_name):
 
     st.write("")
     c1, c2 = st.columns(2)
-    if c1.button("もう一度挑戦", type="primary"):
-        init_game_state()
-        st.rerun()
-    if c2.button("トップに戻る"):
-        st.session_state.page = "home"
-        st.rerun()
+    c1.button("もう一度挑戦", type="primary", on_click=init_game_state)
+    c2.button("トップに戻る", on_click=go_to, args=("home",))
 
 # ==========================================
 # モード1：チャレンジモード (入力式)
 # ==========================================
-def mode_training(advanced=False):
-    mode_name = "チャレンジ(上級)" if advanced else "チャレンジ(基礎)"
+def mode_training(advanced=False, daily=False):
+    if daily:
+        mode_name = daily_mode_name("daily_training", st.session_state.daily_day)
+    else:
+        mode_name = "チャレンジ(上級)" if advanced else "チャレンジ(基礎)"
     st.markdown(f"## 💪 {mode_name}")
     
     if st.session_state.game_finished:
         show_result_screen(mode_name)
         return
 
+    st.button("トップに戻る（中断）", on_click=go_to, args=("home",))
+    training_card(advanced, daily)
+
+@st.fragment
+def training_card(advanced, daily):
+    """進捗・問題カード・回答欄。この中の操作ではこの部分だけが再実行される"""
+    with script_metrics(st.session_state.page, "fragment"):
+        _training_card(advanced, daily)
+
+def _training_card(advanced, daily):
+    if st.session_state.game_finished:
+        # 結果画面はフラグメントの外にあるので、最終問題の後だけアプリ全体を再実行する
+        st.rerun()
+
     progress = st.session_state.current_q_idx / TOTAL_QUESTIONS
     st.progress(progress)
     st.caption(f"Q.{st.session_state.current_q_idx} / {TOTAL_QUESTIONS} | Score: {st.session_state.score}")
-    
-    if st.button("トップに戻る（中断）"):
-        st.session_state.page = "home"
-        st.rerun()
 
     if st.session_state.quiz_data is None:
-        force_p = None
-        if advanced:
-            if st.session_state.current_q_idx > 6: force_p = 3
+        if daily:
+            st.session_state.quiz_data = get_daily_challenge("daily_training", st.session_state.daily_day)[st.session_state.current_q_idx - 1]
         else:
-            while True:
-                temp_q = generate_question_data(is_advanced=False)
-                if temp_q['pattern'] != 3:
-                    st.session_state.quiz_data = temp_q
-                    break
-        if st.session_state.quiz_data is None:
-             st.session_state.quiz_data = generate_question_data(is_advanced=advanced, force_pattern=force_p)
+            if advanced:
+                force_p = 3 if st.session_state.current_q_idx > 6 else None
+                st.session_state.quiz_data = generate_question_data(is_advanced=True, force_pattern=force_p, sampler=session_sampler())
+            else:
+                st.session_state.quiz_data = generate_question_data(is_advanced=False, exclude_pattern=3, sampler=session_sampler())
+            st.session_state.quiz_data['explanation'] = build_explanation(st.session_state.quiz_data)
 
     q = st.session_state.quiz_data
 
@@ -548,41 +364,11 @@ def mode_training(advanced=False):
         st.markdown(f"<p style='color:#FACC15; font-weight:bold;'>入力プレビュー: {user_ans:,} 円</p>", unsafe_allow_html=True)
     
     if not st.session_state.quiz_answered:
-        if st.button("答え合わせ"):
-            elapsed = time.time() - st.session_state.current_start_time
-            st.session_state.total_duration += elapsed
-            st.session_state.current_q_time = elapsed
-            st.session_state.quiz_answered = True
-            st.rerun()
+        st.button("答え合わせ", on_click=stop_timer)
     else:
         correct_val = q['correct']
         pattern_used = q['pattern']
-        v1 = q['raw_val1']
-        v2 = q['raw_val2']
-        pct = q['raw_pct']
-        u1 = q['unit1']
-        u2 = q['unit2']
-        
-        calc_str_arabic = ""
-        if pattern_used == 1: calc_str_arabic = f"{v1:,} × {v2:,} = {correct_val:,.0f}"
-        elif pattern_used == 2: calc_str_arabic = f"{v1:,} × {pct}% = {correct_val:,.0f}"
-        elif pattern_used == 3: calc_str_arabic = f"{v1:,} × {v2:,} × {pct}% = {correct_val:,.0f}"
-        elif pattern_used == 4: calc_str_arabic = f"{v1:,} × {v2} = {correct_val:,.0f}"
-
-        f_v1 = format_japanese_answer(v1) + u1
-        f_ans = format_japanese_answer(correct_val) + "円"
-        calc_str_kanji = ""
-        if pattern_used == 1: 
-            f_v2 = format_japanese_answer(v2) + u2
-            calc_str_kanji = f"{f_v1} × {f_v2} ＝ {f_ans}"
-        elif pattern_used == 2: 
-            calc_str_kanji = f"{f_v1} × {pct}% ＝ {f_ans}"
-        elif pattern_used == 3: 
-            f_v2 = format_japanese_answer(v2) + u2
-            calc_str_kanji = f"{f_v1} × {f_v2} × {pct}% ＝ {f_ans}"
-        elif pattern_used == 4: 
-            f_v2 = f"{v2}{u2}"
-            calc_str_kanji = f"{f_v1} × {f_v2} ＝ {f_ans}"
+        calc_str_arabic, calc_str_kanji = q['explanation']
 
         points, diff_pct, is_perfect = calculate_score(user_ans, correct_val)
         
@@ -593,6 +379,9 @@ def mode_training(advanced=False):
                 "formula_kanji": calc_str_kanji,
                 "time": st.session_state.current_q_time
             })
+            record_attempt(st.session_state.page, q, user_ans, diff_pct, points, st.session_state.current_q_time)
+            record_answer_stats(st.session_state.page, pattern_used, diff_pct, points >= 8, st.session_state.current_q_time)
+            update_session_sampler(q, 1 - points / 10)
 
         st.markdown(f"あなたの回答: **{user_ans:,}**")
         st.info(f"🧮 計算イメージ: {calc_str_arabic}")
@@ -608,67 +397,53 @@ def mode_training(advanced=False):
             st.error(f"❌ 残念... 獲得ポイント: {points}点 (ズレ: {diff_pct:.2f}%)")
             st.info(get_mental_math_tip(pattern_used))
 
-        if st.button("次の問題へ", type="primary"):
-            st.session_state.score += points
-            if is_perfect: st.session_state.exact_matches += 1
-            next_question()
-            st.rerun()
+        st.button("次の問題へ", type="primary", on_click=advance_question, args=(points, is_perfect))
 
 # ==========================================
 # モード2：お気軽モード (4択式)
 # ==========================================
-def mode_quiz(advanced=False):
-    mode_name = "お気軽(上級)" if advanced else "お気軽(基礎)"
+def mode_quiz(advanced=False, daily=False):
+    if daily:
+        mode_name = daily_mode_name("daily_quiz", st.session_state.daily_day)
+    else:
+        mode_name = "お気軽(上級)" if advanced else "お気軽(基礎)"
     st.markdown(f"## 🧩 {mode_name}")
     
     if st.session_state.game_finished:
         show_result_screen(mode_name)
         return
 
+    st.button("トップに戻る（中断）", on_click=go_to, args=("home",))
+    quiz_card(advanced, daily)
+
+@st.fragment
+def quiz_card(advanced, daily):
+    """進捗・問題カード・回答欄。この中の操作ではこの部分だけが再実行される"""
+    with script_metrics(st.session_state.page, "fragment"):
+        _quiz_card(advanced, daily)
+
+def _quiz_card(advanced, daily):
+    if st.session_state.game_finished:
+        # 結果画面はフラグメントの外にあるので、最終問題の後だけアプリ全体を再実行する
+        st.rerun()
+
     progress = st.session_state.current_q_idx / TOTAL_QUESTIONS
     st.progress(progress)
     st.caption(f"Q.{st.session_state.current_q_idx} / {TOTAL_QUESTIONS} | Score: {st.session_state.score}")
 
-    if st.button("トップに戻る（中断）"):
-        st.session_state.page = "home"
-        st.rerun()
-
-    if st.session_state.quiz_data is None:
-        force_p = None
+    if st.session_state.quiz_data is None and daily:
+        st.session_state.quiz_data = get_daily_challenge("daily_quiz", st.session_state.daily_day)[st.session_state.current_q_idx - 1]
+    elif st.session_state.quiz_data is None:
         if advanced:
-            if st.session_state.current_q_idx > 6: force_p = 3
+            force_p = 3 if st.session_state.current_q_idx > 6 else None
+            st.session_state.quiz_data = generate_question_data(is_advanced=True, force_pattern=force_p, sampler=session_sampler())
         else:
-            while True:
-                temp_q = generate_question_data(is_advanced=False)
-                if temp_q['pattern'] != 3:
-                    st.session_state.quiz_data = temp_q
-                    break
-        
-        if st.session_state.quiz_data is None:
-             if not advanced:
-                 st.session_state.quiz_data = generate_question_data(is_advanced=False, force_pattern=force_p, simple_amounts=False, simple_pct=True)
-             else:
-                 st.session_state.quiz_data = generate_question_data(is_advanced=True, force_pattern=force_p)
+            st.session_state.quiz_data = generate_question_data(is_advanced=False, exclude_pattern=3, sampler=session_sampler())
         
         q = st.session_state.quiz_data
-        correct = q['correct']
-        options = [correct]
-        
-        if advanced:
-            multipliers = [0.85, 0.90, 0.95, 1.05, 1.10, 1.15]
-            selected_mults = random.sample(multipliers, 3)
-            for m in selected_mults:
-                options.append(correct * m)
-        else:
-            if q['pattern'] == 2:
-                options.extend([correct * 0.8, correct * 1.2, correct * 1.5])
-            else:
-                options.append(correct * 10)
-                options.append(correct / 10)
-                options.append(random.choice([correct * 100, correct / 100, correct * 2]))
-
-        random.shuffle(options)
-        q['options'] = options
+        q['options'] = build_quiz_options(q, advanced)
+        q['option_labels'] = [format_japanese_answer(opt) for opt in q['options']]
+        q['explanation'] = build_explanation(q)
 
     q = st.session_state.quiz_data
     
@@ -684,51 +459,18 @@ def mode_quiz(advanced=False):
 
     if not st.session_state.quiz_answered:
         col1, col2 = st.columns(2)
-        for i, opt in enumerate(q['options']):
-            btn_label = format_japanese_answer(opt)
+        for i, (opt, btn_label) in enumerate(zip(q['options'], q['option_labels'])):
             target_col = col1 if i % 2 == 0 else col2
             
-            if target_col.button(f"{btn_label}", key=f"q_{st.session_state.current_q_idx}_opt_{i}", use_container_width=True):
-                elapsed = time.time() - st.session_state.current_start_time
-                st.session_state.total_duration += elapsed
-                st.session_state.current_q_time = elapsed
-                
-                st.session_state.quiz_answered = True
-                st.session_state.user_choice = opt
-                st.rerun()
+            target_col.button(f"{btn_label}", key=f"q_{st.session_state.current_q_idx}_opt_{i}", use_container_width=True,
+                              on_click=submit_choice, args=(opt,))
     else:
         user_val = st.session_state.user_choice
         correct_val = q['correct']
-        v1 = q['raw_val1']
-        v2 = q['raw_val2']
-        pct = q['raw_pct']
         pat = q['pattern']
-        u1 = q['unit1']
-        u2 = q['unit2']
-        
-        calc_str_arabic = ""
-        if pat == 1: calc_str_arabic = f"{v1:,} × {v2:,} = {correct_val:,.0f}"
-        elif pat == 2: calc_str_arabic = f"{v1:,} × {pct}% = {correct_val:,.0f}"
-        elif pat == 3: calc_str_arabic = f"{v1:,} × {v2:,} × {pct}% = {correct_val:,.0f}"
-        elif pat == 4: calc_str_arabic = f"{v1:,} × {v2} = {correct_val:,.0f}"
-
-        f_v1 = format_japanese_answer(v1) + u1
-        f_ans = format_japanese_answer(correct_val) + "円"
-        calc_str_kanji = ""
-        if pat == 1: 
-            f_v2 = format_japanese_answer(v2) + u2
-            calc_str_kanji = f"{f_v1} × {f_v2} ＝ {f_ans}"
-        elif pat == 2: 
-            calc_str_kanji = f"{f_v1} × {pct}% ＝ {f_ans}"
-        elif pat == 3: 
-            f_v2 = format_japanese_answer(v2) + u2
-            calc_str_kanji = f"{f_v1} × {f_v2} × {pct}% ＝ {f_ans}"
-        elif pat == 4: 
-            f_v2 = f"{v2}{u2}"
-            calc_str_kanji = f"{f_v1} × {f_v2} ＝ {f_ans}"
-
-        ratio = user_val / correct_val if correct_val != 0 else 0
-        is_correct = (0.99 <= ratio <= 1.01)
+        calc_str_arabic, calc_str_kanji = q['explanation']
+
+        is_correct = is_choice_correct(user_val, correct_val)
         
         if len(st.session_state.history) < st.session_state.current_q_idx:
             st.session_state.history.append({
@@ -737,6 +479,10 @@ def mode_quiz(advanced=False):
                 "formula_kanji": calc_str_kanji,
                 "time": st.session_state.current_q_time
             })
+            diff_pct = abs((user_val - correct_val) / correct_val * 100) if correct_val != 0 else 0.0
+            record_attempt(st.session_state.page, q, user_val, diff_pct, 1 if is_correct else 0, st.session_state.current_q_time)
+            record_answer_stats(st.session_state.page, pat, diff_pct, is_correct, st.session_state.current_q_time)
+            update_session_sampler(q, 0.0 if is_correct else 1.0)
         
         if is_correct: 
             st.success("🎉 正解！")
@@ -746,10 +492,7 @@ def mode_quiz(advanced=False):
         
         st.info(f"🧮 計算イメージ: {calc_str_arabic}")
 
-        if st.button("次の問題へ", type="primary"):
-            if is_correct: st.session_state.score += 1
-            next_question()
-            st.rerun()
+        st.button("次の問題へ", type="primary", on_click=advance_question, args=(1 if is_correct else 0,))
 
 # ==========================================
 # モード4: 暗算のTips集
@@ -757,9 +500,7 @@ def mode_quiz(advanced=False):
 def mode_tips():
     st.markdown("## 💡 暗算・概算のコツ")
     
-    if st.button("トップに戻る"):
-        st.session_state.page = "home"
-        st.rerun()
+    st.button("トップに戻る", on_click=go_to, args=("home",))
     
     st.markdown("---")
 
@@ -804,9 +545,7 @@ def mode_tips():
     """)
 
     st.markdown("---")
-    if st.button("トップに戻る", key="back_bottom"):
-        st.session_state.page = "home"
-        st.rerun()
+    st.button("トップに戻る", key="back_bottom", on_click=go_to, args=("home",))
 
 # ==========================================
 # モード3: フラッシュカード (桁感特訓)
@@ -814,9 +553,7 @@ def mode_tips():
 def mode_flashcard():
     st.markdown("## ⚡ フラッシュカード（桁感特訓）")
     
-    if st.button("トップに戻る"):
-        st.session_state.page = "home"
-        st.rerun()
+    st.button("トップに戻る", on_click=go_to, args=("home",))
         
     st.caption("エンドレスモード: タップして次々と答えを確認しましょう。")
 
@@ -830,32 +567,92 @@ def mode_flashcard():
     st.markdown(f"""
     <div class="css-card">
         <div class="flashcard-q">{q['q_text']}</div>
-        {"<div class='flashcard-a'>" + format_japanese_answer(q['correct']) + "</div>" if st.session_state.flash_state == "answer" else ""}
+        {"<div class='flashcard-a'>" + q['answer_label'] + "</div>" if st.session_state.flash_state == "answer" else ""}
     </div>
     """, unsafe_allow_html=True)
 
     if st.session_state.flash_state == "question":
-        if st.button("答えを見る", type="primary", use_container_width=True):
-            st.session_state.flash_state = "answer"
-            st.rerun()
+        st.button("答えを見る", type="primary", use_container_width=True, on_click=show_flash_answer)
     else:
-        if st.button("次の問題へ", type="primary", use_container_width=True):
-            st.session_state.quiz_data = None
-            st.session_state.flash_state = "question"
-            st.rerun()
+        st.button("次の問題へ", type="primary", use_container_width=True, on_click=next_flashcard)
+
+# ==========================================
+# 統計ダッシュボード
+# ==========================================
+STATS_NICKNAME_LIMIT = 50
+
+def _stats_table(merged, kind, label, order=None, limit=None):
+    import pandas as pd
+    items = [(key, agg) for (k, key), agg in merged.items() if k == kind]
+    if order is not None:
+        items.sort(key=lambda kv: order(kv[0]))
+    else:
+        items.sort(key=lambda kv: -kv[1].count)
+    rows = [{label: key, **agg.summary()} for key, agg in items[:limit]]
+    if not rows:
+        st.info("まだ解答データがありません。")
+        return
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+def mode_stats():
+    st.markdown("## 📈 統計ダッシュボード")
+    st.button("トップに戻る", on_click=go_to, args=("home",))
+    st.caption(f"全サーバープロセスの集計 (他プロセスの分は最大 {STATS_SNAPSHOT_INTERVAL} 秒遅れ)。正答率はチャレンジモードでは 8点以上を正解とみなす。")
+
+    merged = merged_answer_stats()
+    tab1, tab2, tab3, tab4 = st.tabs(["パターン別", "モード別", "ニックネーム別", "再採点"])
+    with tab1:
+        named = {("pattern", f"{p}: {PATTERN_LABELS.get(p, '')}"): agg for (k, p), agg in merged.items() if k == "pattern"}
+        _stats_table(named, "pattern", "パターン", order=lambda key: key)
+    with tab2:
+        named = {("mode", MODE_LABELS.get(m, m)): agg for (k, m), agg in merged.items() if k == "mode"}
+        _stats_table(named, "mode", "モード")
+    with tab3:
+        st.caption(f"解答数の多い上位 {STATS_NICKNAME_LIMIT} 人 (ランキング登録時に集計)")
+        _stats_table(merged, "nickname", "ニックネーム", limit=STATS_NICKNAME_LIMIT)
+    with tab4:
+        st.caption("解答記録を今の採点基準で採点し直した平均点 (記録時の点との比較)")
+        _regrade_table()
+
+def _regrade_table():
+    import pandas as pd
+    rows = cached_regrade_attempts()
+    if not rows:
+        st.info("まだ解答記録がありません。")
+        return
+    st.dataframe(pd.DataFrame([{"モード": MODE_LABELS.get(r["mode"], r["mode"]), "件数": r["count"],
+                                "平均点 (記録時)": round(r["recorded"], 2), "平均点 (再採点)": round(r["regraded"], 2),
+                                "点が変わる件数": r["changed"]} for r in rows]),
+                 use_container_width=True, hide_index=True)
 
 # ==========================================
 # メイン
 # ==========================================
+def show_metrics_panel():
+    import pandas as pd
+    with st.sidebar.expander("📈 メトリクス (管理者用)"):
+        st.dataframe(pd.DataFrame(METRICS.summary()), use_container_width=True, hide_index=True)
+        if METRICS_FILE:
+            st.caption(f"書き出し先: {METRICS_FILE.format(pid=os.getpid())}")
+        st.code(METRICS.render(), language=None)
+
 def main():
+    METRICS.observe("mental_math_module_seconds", time.perf_counter() - _SCRIPT_T0)
     st.set_page_config(page_title="ビジネス暗算道場", page_icon="💼")
-    apply_custom_design()
     
     if 'page' not in st.session_state:
         st.session_state.page = "home"
     if 'current_q_idx' not in st.session_state:
         init_game_state()
 
+    with script_metrics(st.session_state.page, "app"):
+        apply_custom_design()
+        render_page()
+    METRICS.set_once("mental_math_first_render_seconds", time.perf_counter() - _SCRIPT_T0)
+    if ADMIN_DEBUG:
+        show_metrics_panel()
+
+def render_page():
     if st.session_state.page == "home":
         st.markdown("<h1 style='text-align: center; color: #38BDF8; font-size: 3.5rem; text-shadow: 0 0 20px rgba(56, 189, 248, 0.5);'>💼 ビジネス暗算道場</h1>", unsafe_allow_html=True)
         st.markdown("<p style='text-align: center; color: #94A3B8;'>Advance your mental math skills with professional tools.</p>", unsafe_allow_html=True)
@@ -866,59 +663,37 @@ def main():
         
         with col1:
             st.success("🧩 お気軽モード（4択式）")
-            if st.button("基礎編", key="quiz_basic_btn", use_container_width=True):
-                init_game_state()
-                st.session_state.page = "quiz"
-                st.rerun()
-            if st.button("上級編", key="quiz_adv_btn", use_container_width=True):
-                init_game_state()
-                st.session_state.page = "quiz_advanced"
-                st.rerun()
+            st.button("基礎編", key="quiz_basic_btn", use_container_width=True, on_click=start_game, args=("quiz",))
+            st.button("上級編", key="quiz_adv_btn", use_container_width=True, on_click=start_game, args=("quiz_advanced",))
             st.caption("4択で瞬時に判断する実戦モード。")
 
         with col2:
             st.info("📊 チャレンジモード（入力式）")
-            if st.button("基礎編", key="train_basic_btn", use_container_width=True):
-                init_game_state()
-                st.session_state.page = "training"
-                st.rerun()
-            if st.button("上級編", key="train_adv_btn", use_container_width=True):
-                init_game_state()
-                st.session_state.page = "training_advanced"
-                st.rerun()
+            st.button("基礎編", key="train_basic_btn", use_container_width=True, on_click=start_game, args=("training",))
+            st.button("上級編", key="train_adv_btn", use_container_width=True, on_click=start_game, args=("training_advanced",))
             st.caption("誤差2%以内で満点。基礎は丸い数字、上級は実戦的。")
 
+        # デイリーチャレンジ
+        st.warning("📅 デイリーチャレンジ（全員共通の10問・上級）")
+        dc1, dc2 = st.columns(2)
+        for col, page in zip([dc1, dc2], DAILY_MODES):
+            col.button(DAILY_MODES[page], key=f"{page}_btn", use_container_width=True, on_click=start_game, args=(page,))
+        st.caption("今日の問題は全員同じ。日替わりランキングで腕試し。")
+
         # フラッシュカード
-        if st.button("⚡ フラッシュカード（桁感特訓）", use_container_width=True):
-            init_game_state()
-            st.session_state.page = "flashcard"
-            st.rerun()
+        st.button("⚡ フラッシュカード（桁感特訓）", use_container_width=True, on_click=start_game, args=("flashcard",))
         st.caption("「100×1万」など、0の数を瞬時に把握するエンドレスモード。")
         
         # Tipsボタン
-        if st.button("💡 暗算のコツ (Tips)", use_container_width=True):
-            st.session_state.page = "tips"
-            st.rerun()
+        st.button("💡 暗算のコツ (Tips)", use_container_width=True, on_click=go_to, args=("tips",))
+        st.button("📈 統計ダッシュボード", use_container_width=True, on_click=go_to, args=("stats",))
 
         # ランキング表示エリア (タブ分け)
         st.write("")
         st.markdown("---")
         st.subheader("🏆 最新ランキング")
         
-        tab1, tab2, tab3, tab4 = st.tabs(["お気軽(基礎)", "お気軽(上級)", "チャレンジ(基礎)", "チャレンジ(上級)"])
-        
-        with tab1:
-            st.caption("お気軽モード（基礎編）")
-            display_ranking("お気軽(基礎)")
-        with tab2:
-            st.caption("お気軽モード（上級編）")
-            display_ranking("お気軽(上級)")
-        with tab3:
-            st.caption("チャレンジモード（基礎編）")
-            display_ranking("チャレンジ(基礎)")
-        with tab4:
-            st.caption("チャレンジモード（上級編）")
-            display_ranking("チャレンジ(上級)")
+        ranking_tabs()
 
         st.write("")
         st.markdown("---")
@@ -937,10 +712,16 @@ def main():
         mode_quiz(advanced=False)
     elif st.session_state.page == "quiz_advanced":
         mode_quiz(advanced=True)
+    elif st.session_state.page == "daily_quiz":
+        mode_quiz(advanced=True, daily=True)
+    elif st.session_state.page == "daily_training":
+        mode_training(advanced=True, daily=True)
     elif st.session_state.page == "flashcard":
         mode_flashcard()
     elif st.session_state.page == "tips":
         mode_tips()
+    elif st.session_state.page == "stats":
+        mode_stats()
 
 if __name__ == "__main__":
     main()
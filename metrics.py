@@ -0,0 +1,186 @@
+"""
+計測 (メトリクス) とプロファイル。
+
+プロセスに1つの METRICS に、アプリ・ランキング・統計の各モジュールが値を記録する。
+Streamlit のスクリプトは再実行のたびに読み直されるが、このモジュールは1度だけ import されるので、
+ここに置いた状態はプロセスの全セッションで共有される。
+"""
+import bisect
+import cProfile
+import functools
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+METRICS_FILE = os.environ.get("METRICS_FILE")  # 例: "metrics_{pid}.prom" (未設定なら書き出さない)
+METRICS_FLUSH_INTERVAL = 10  # 秒
+PROFILE_DIR = os.environ.get("PROFILE_DIR")  # 設定すると再実行ごとに cProfile の結果を書き出す
+PROFILE_SAMPLE = float(os.environ.get("PROFILE_SAMPLE", "1.0"))  # プロファイルを取る再実行の割合
+
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTE_BUCKETS = tuple(1024 * 4**i for i in range(10))  # 1KB 〜 256MB
+ROW_BUCKETS = tuple(2**i for i in range(10))  # 1 〜 512 行
+
+METRIC_DEFS = {
+    "mental_math_script_seconds": ("histogram", "再実行 (ページ全体またはフラグメント) 1回の所要時間", TIME_BUCKETS),
+    "mental_math_payload_bytes": ("histogram", "再実行 1回でブラウザに送ったメッセージの合計サイズ", BYTE_BUCKETS),
+    "mental_math_ranking_parse_seconds": ("histogram", "ranking.csv の読み込み・パース時間", TIME_BUCKETS),
+    "mental_math_ranking_save_seconds": ("histogram", "ランキング登録の書き込み時間", TIME_BUCKETS),
+    "mental_math_question_generation_seconds": ("histogram", "問題生成の所要時間", TIME_BUCKETS),
+    "mental_math_ranking_rows": ("gauge", "最後に読み込んだ ranking.csv の行数", None),
+    "mental_math_ranking_file_bytes": ("gauge", "最後に読み込んだ ranking.csv のサイズ", None),
+    "mental_math_ranking_loads_total": ("counter", "ranking.csv を読み込んだ回数", None),
+    "mental_math_ranking_connections_total": ("counter", "ランキングのストアに新しく張った接続の数", None),
+    "mental_math_ranking_batch_rows": ("histogram", "バックグラウンドの書き込み1回にまとめた登録の件数", ROW_BUCKETS),
+    "mental_math_ranking_queue_depth": ("gauge", "書き込み待ちの登録の件数 (最後に書き込みを始めた時点)", None),
+    "mental_math_ranking_write_errors_total": ("counter", "バックグラウンドの書き込みが失敗した回数", None),
+    "mental_math_attempt_write_errors_total": ("counter", "解答記録の書き込みが失敗した回数", None),
+    "mental_math_module_seconds": ("histogram", "再実行ごとのスクリプト冒頭 (import・定義) の実行時間", TIME_BUCKETS),
+    "mental_math_first_render_seconds": ("gauge", "プロセスで最初の再実行の開始から描画完了までの時間", None),
+    "mental_math_metrics_flush_errors_total": ("counter", "METRICS_FILE への書き出しが失敗した回数", None),
+    "mental_math_profile_write_errors_total": ("counter", "PROFILE_DIR へのプロファイルの書き出しが失敗した回数", None),
+}
+
+class MetricsRegistry:
+    """
+    プロセス内のカウンター・ゲージ・ヒストグラム。値は (メトリクス名, ラベル) ごとに持ち、
+    Prometheus のテキスト形式で書き出せる。
+    """
+    def __init__(self, defs):
+        self.defs = defs
+        self.lock = threading.Lock()
+        self.values = {}  # (name, labels) -> 数値 または [バケット別件数, 合計, 件数]
+        self.last_flush = 0.0
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def set_once(self, name, value, **labels):
+        """まだ値がなければ設定する (プロセスで最初の1回だけ記録したい値用)"""
+        with self.lock:
+            self.values.setdefault((name, tuple(sorted(labels.items()))), value)
+
+    def observe(self, name, value, **labels):
+        buckets = self.defs[name][2]
+        i = bisect.bisect_left(buckets, value)
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.values.get(key)
+            if h is None:
+                h = self.values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def render(self):
+        with self.lock:
+            items = sorted((k, (v[0][:], v[1], v[2]) if isinstance(v, list) else v) for k, v in self.values.items())
+        lines = []
+        for name, (kind, help_text, buckets) in self.defs.items():
+            series = [(labels, v) for (n, labels), v in items if n == name]
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, v in series:
+                if kind != "histogram":
+                    lines.append(f"{name}{_label_str(labels)} {v}")
+                    continue
+                counts, total, n = v
+                cumulative = 0
+                for bound, c in zip(buckets + (float("inf"),), counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_label_str(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_label_str(labels)} {total}")
+                lines.append(f"{name}_count{_label_str(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """デバッグ表示用に、系列ごとの件数・平均 (ゲージ・カウンターは値) を並べる"""
+        with self.lock:
+            items = sorted(self.values.items())
+        rows = []
+        for (name, labels), v in items:
+            label = ", ".join(f"{k}={val}" for k, val in labels)
+            if isinstance(v, list):
+                rows.append({"メトリクス": name, "ラベル": label, "件数": v[2], "平均/値": v[1] / v[2] if v[2] else 0.0})
+            else:
+                rows.append({"メトリクス": name, "ラベル": label, "件数": None, "平均/値": float(v)})
+        return rows
+
+    def flush(self, path, force=False):
+        """path に書き出す。METRICS_FLUSH_INTERVAL 秒に1回まで (force なら必ず)"""
+        now = time.time()
+        with self.lock:  # 同時に再実行したセッションのうち1つだけが書く
+            if not force and now - self.last_flush < METRICS_FLUSH_INTERVAL:
+                return
+            self.last_flush = now
+        path = path.format(pid=os.getpid())
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp, path)  # 収集側が書きかけのファイルを読まないように置き換える
+        except OSError as e:
+            # 書き出せなくてもページの表示は止めない (次の間隔でやり直す)
+            self.inc("mental_math_metrics_flush_errors_total")
+            print(f"メトリクスを {path} に書き出せませんでした ({type(e).__name__}: {e})", file=sys.stderr)
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels) + "}"
+
+METRICS = MetricsRegistry(METRIC_DEFS)
+
+def timed(name, **labels):
+    """関数の所要時間をヒストグラム name に記録するデコレーター"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                METRICS.observe(name, time.perf_counter() - t0, **labels)
+        return wrapper
+    return decorator
+
+# プロファイルの抽選用の乱数 (出題用の random の系列を乱さないよう別にする) とファイル名の通し番号
+_profile_rng = random.Random()
+_profile_seq = itertools.count(1)
+
+def start_profile():
+    """PROFILE_DIR が設定されていれば PROFILE_SAMPLE の割合で cProfile を始め、始めたらそのプロファイラーを返す"""
+    if not PROFILE_DIR or _profile_rng.random() >= PROFILE_SAMPLE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Python 3.12 以降、別スレッドのプロファイル中は取れないので見送る
+        return None
+    return profiler
+
+def dump_profile(profiler, page, scope):
+    """プロファイラーを止めて PROFILE_DIR/<ページ>/ に書き出す"""
+    profiler.disable()
+    out_dir = os.path.join(PROFILE_DIR, page)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(out_dir, f"{scope}-{stamp}-{os.getpid()}-{next(_profile_seq)}.prof"))
+    except OSError as e:
+        # プロファイルが書けなくてもページの表示とメトリクスの記録は続ける
+        METRICS.inc("mental_math_profile_write_errors_total")
+        print(f"プロファイルを {out_dir} に書き出せませんでした ({type(e).__name__}: {e})", file=sys.stderr)
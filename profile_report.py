@@ -0,0 +1,59 @@
+"""
+PROFILE_DIR に溜まったプロファイルをページごとに集計して表示する。
+
+    PROFILE_DIR=profiles PROFILE_SAMPLE=0.1 streamlit run mental_math_app.py
+    python profile_report.py profiles                     # 全ページの上位 20 関数 (累積時間順)
+    python profile_report.py profiles --page quiz --top 40 --sort tottime
+    python profile_report.py profiles --scope fragment    # フラグメントの再実行だけ
+
+ファイルは <PROFILE_DIR>/<ページ>/<app|fragment>-<日時>-<pid>-<連番>.prof に書かれる。
+pstats でそのまま読めるので、snakeviz などのビューアーにも渡せる。
+"""
+import argparse
+import glob
+import os
+import pstats
+import sys
+
+
+def collect(profile_dir, page=None, scope=None):
+    """{ページ: [プロファイルのパス]} を返す"""
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(profile_dir, "*", "*.prof"))):
+        page_name = os.path.basename(os.path.dirname(path))
+        if page is not None and page_name != page:
+            continue
+        if scope is not None and not os.path.basename(path).startswith(scope + "-"):
+            continue
+        pages.setdefault(page_name, []).append(path)
+    return pages
+
+
+def report(pages, top, sort, out=sys.stdout):
+    for page_name, paths in pages.items():
+        stats = pstats.Stats(*paths, stream=out)
+        per_run = stats.total_tt / len(paths) * 1000
+        print(f"=== {page_name}: {len(paths)} 回分, 1回あたり {per_run:.1f} ms ===", file=out)
+        stats.files = []  # 読み込んだファイル名の一覧は長くなるので出さない
+        stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビジネス暗算道場 プロファイル集計")
+    parser.add_argument("profile_dir", nargs="?", default=os.environ.get("PROFILE_DIR", "profiles"))
+    parser.add_argument("--page", help="このページだけ集計する (home, quiz, training_advanced, flashcard など)")
+    parser.add_argument("--scope", choices=["app", "fragment"], help="ページ全体 / フラグメントの再実行に絞る")
+    parser.add_argument("--top", type=int, default=20, help="表示する関数の数")
+    parser.add_argument("--sort", default="cumulative", help="pstats の並び順 (cumulative, tottime, ncalls など)")
+    args = parser.parse_args(argv)
+
+    pages = collect(args.profile_dir, args.page, args.scope)
+    if not pages:
+        print(f"{args.profile_dir} にプロファイルがありません。")
+        return 1
+    report(pages, args.top, args.sort)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
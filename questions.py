@@ -0,0 +1,669 @@
+"""
+出題 (問題・選択肢・解説・フラッシュカード・デイリーチャレンジ) と採点。
+
+シナリオ表や表示用のキャッシュなど、プロセスで1度だけ作ればよいものを cache_resource に持つ。
+スクリプトの中で cache_resource を付けると再実行のたびに関数のキーの計算 (ソースの読み込み) が
+走るので、それらはこのモジュールに置き、import したときに1度だけ定義する。
+"""
+import bisect
+import functools
+import importlib
+import random
+import sys
+
+import streamlit as st
+
+from metrics import timed
+from ranking import DAILY_MODES
+from stats import ATTEMPT_MODES, STATS_SNAPSHOT_INTERVAL, load_attempts
+
+class _LazyModule:
+    """
+    属性に初めて触れたときに import するモジュールの代理。pandas / numpy の読み込みは重いので、
+    ランキング表や一括処理を使うまで後回しにする (フラッシュカードや Tips だけなら読み込まない)。
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+
+ADAPTIVE_PRIOR = 0.5  # まだ解いていないシナリオの失点率の初期値
+ADAPTIVE_ALPHA = 0.3  # 失点率の指数移動平均の係数 (大きいほど直近の解答を重視)
+ADAPTIVE_FLOOR = 0.25  # 得意なシナリオにも残す重み
+MAX_LIMIT = 10**13
+TOTAL_QUESTIONS = 10
+FORMAT_CACHE_SIZE = 8192
+
+# ==========================================
+# 共通関数: 数値フォーマット・生成
+# ==========================================
+JAPANESE_UNITS = [(10**12, "兆"), (10**8, "億"), (10**4, "万"), (1, "")]
+
+def _format_japanese_answer(num):
+    try:
+        int_num = int(num)
+    except (TypeError, ValueError, OverflowError):
+        return str(num)
+    if int_num == 0: return "0"
+    result = []
+    remaining = abs(int_num)
+    for unit_val, unit_name in JAPANESE_UNITS:
+        if remaining >= unit_val:
+            val = remaining // unit_val
+            remaining %= unit_val
+            result.append(f"{val:,}{unit_name}")
+    return "".join(result) if result else "0"
+
+def _format_number_with_unit_label(value):
+    if value >= 10**8:
+        if value % 10**8 == 0: return f"{value // 10**8:,}億"
+        else: return f"{value / 10**8:.1f}億".replace(".0", "")
+    elif value >= 10**4:
+        if value % 10**4 == 0: return f"{value // 10**4:,}万"
+        else: return f"{value / 10**4:.1f}万".replace(".0", "")
+    else:
+        return f"{value:,}"
+
+# プロセスで共有する LRU。1 と 1.0 で結果が変わり得るので typed=True
+_cached_japanese_answer = functools.lru_cache(maxsize=FORMAT_CACHE_SIZE, typed=True)(_format_japanese_answer)
+_cached_unit_label = functools.lru_cache(maxsize=FORMAT_CACHE_SIZE, typed=True)(_format_number_with_unit_label)
+
+def format_japanese_answer(num):
+    try:
+        return _cached_japanese_answer(num)
+    except TypeError:  # ハッシュできない値はキャッシュを通さない
+        return _format_japanese_answer(num)
+
+def format_number_with_unit_label(value):
+    try:
+        return _cached_unit_label(value)
+    except TypeError:
+        return _format_number_with_unit_label(value)
+
+@st.cache_resource
+def _group_label_tables():
+    # 単位ごとに 0〜9999 の表記 (0 は空文字) を引ける表。各桁グループはこの範囲に収まる
+    return [np.array([""] + [f"{i:,}{unit_name}" for i in range(1, 10**4)]) for _, unit_name in JAPANESE_UNITS]
+
+def format_japanese_answers(values):
+    """
+    format_japanese_answer の一括版。配列・Series・リストをまとめて変換し、1件ずつ変換した
+    場合と同じ文字列を返す (Series なら同じ index の Series を、スカラーなら文字列を返す)。
+    """
+    # Series が渡されるなら pandas は読み込み済みなので、判定のために読み込むことはしない
+    pandas = sys.modules.get("pandas")
+    index = values.index if pandas is not None and isinstance(values, pandas.Series) else None
+    arr = np.asarray(values)
+    scalar = arr.ndim == 0
+    arr = np.atleast_1d(arr)
+    out = np.empty(arr.shape, dtype=object)
+
+    if arr.dtype.kind in "iub":
+        ok = np.ones(arr.shape, dtype=bool) if arr.dtype.kind != "u" else arr <= np.iinfo(np.int64).max
+        ints = np.where(ok, arr, 0).astype(np.int64)
+    elif arr.dtype.kind == "f":
+        ok = np.isfinite(arr) & (np.abs(arr) < 2.0**63)
+        ints = np.trunc(np.where(ok, arr, 0)).astype(np.int64)
+    else:
+        ok = np.zeros(arr.shape, dtype=bool)
+        ints = np.zeros(arr.shape, dtype=np.int64)
+    # 1兆グループが4桁を超える値や int64 の最小値は1件ずつの変換に回す
+    ok &= (ints > np.iinfo(np.int64).min) & (np.abs(ints) < 10**16)
+
+    if ok.any():
+        remaining = np.abs(ints[ok])
+        text = None
+        for (unit_val, _), table in zip(JAPANESE_UNITS, _group_label_tables()):
+            part = table[remaining // unit_val]
+            remaining = remaining % unit_val
+            text = part if text is None else np.char.add(text, part)
+        out[ok] = np.where(text == "", "0", text)
+    for pos in zip(*np.nonzero(~ok)):
+        out[pos] = format_japanese_answer(arr[pos].item() if hasattr(arr[pos], "item") else arr[pos])
+
+    if index is not None:
+        return pd.Series(out, index=index)
+    return out[0] if scalar else out
+
+def format_unit_labels(values):
+    """
+    format_number_with_unit_label の一括版。同じ値の変換は LRU が1回にまとめる。
+    np.asarray で揃えると int と float が混ざったリストが float になり 10000 が "1.0万" になるので、
+    要素は元の Python の値のまま変換する。
+    """
+    if hasattr(values, "tolist"):  # ndarray / Series は要素を Python の数値にする
+        values = values.tolist()
+    return np.array([format_number_with_unit_label(v) for v in values], dtype=object)
+
+SIMPLE_BASES = (10, 20, 30, 40, 50, 60, 70, 80, 90, 15, 25, 12, 18)
+
+def _sample_amount(rng, min_val, max_val, min_digits, max_digits, simple):
+    if simple:
+        # 元の値が1桁のときだけそのまま使うので、1桁になり得ない範囲では最初の抽選を省ける
+        if min_val < 10:
+            val = rng.randint(min_val, max_val)
+            if val < 10: return val
+        val = rng.choice(SIMPLE_BASES) * 10**max(0, rng.randint(min_digits, max_digits) - 2)
+        if val < min_val: val = min_val
+        if val > max_val: val = max_val
+        if val < 100: val = (val // 10) * 10
+        return int(val)
+    return rng.randint(min_val, max_val)
+
+def get_mental_math_tip(pattern):
+    """
+    問題パターンに応じた暗算のコツを返す
+    """
+    common_tips = [
+        "💡 **コツ:** 数字の「0」を一旦無視して、ゼロ以外の数字同士を掛け算しましょう。最後に無視した0の個数を合計して付け足すと簡単です。",
+        "💡 **コツ:** 「万」は0が4つ、「億」は0が8つです。単位を0に置き換えて桁数を整理してみましょう。",
+        "💡 **コツ:** 概算の場合、有効数字（上1〜2桁）だけで計算し、あとは桁数を合わせるのがスピードアップの鍵です。",
+        "💡 **コツ:** 3桁ごとのカンマ「,」の位置を意識しましょう。1,000(千)、1,000,000(百万)、1,000,000,000(十億)が区切りです。"
+    ]
+    
+    pct_tips = [
+        "💡 **コツ:** 10%は「桁を1つ減らす」、1%は「桁を2つ減らす」ことと同じです。これを基準に倍数で考えましょう。",
+        "💡 **コツ:** 5%は「10%の半分」、20%は「10%の2倍」と考えると計算が早くなります。",
+        "💡 **コツ:** ×0.5 (50%) は「半分にする（÷2）」、×0.25 (25%) は「半分の半分（÷4）」と同じです。",
+        "💡 **コツ:** 「70%」などは「100% - 30%」と考えたほうが引き算で早く解ける場合があります。"
+    ]
+    
+    # パターン2, 3は%が含まれる
+    if pattern in [2, 3]:
+        return random.choice(common_tips + pct_tips)
+    else:
+        return random.choice(common_tips)
+
+# ==========================================
+# シナリオデータ定義
+# ==========================================
+SCENARIOS = [
+    # パターン1: A * B
+    { "pattern": 1, "template": "単価 <b>{label1}円</b> の商品が <b>{label2}個</b> 売れました。<br>売上推定値は？", "range1": (100, 50000), "range2": (100, 100000), "unit1":"円", "unit2":"個" },
+    { "pattern": 1, "template": "1人あたり <b>{label1}円</b> のコストがかかる研修に <b>{label2}人</b> が参加します。<br>総費用推定値は？", "range1": (5000, 200000), "range2": (10, 5000), "unit1":"円", "unit2":"人" },
+    { "pattern": 1, "template": "月商 <b>{label1}円</b> の店舗を <b>{label2}店舗</b> 運営しています。<br>全店の月商合計は？", "range1": (1000000, 50000000), "range2": (3, 1000), "unit1":"円", "unit2":"店舗" },
+    { "pattern": 1, "template": "契約単価 <b>{label1}円</b> のサブスク会員が <b>{label2}人</b> います。<br>毎月の売上は？", "range1": (500, 10000), "range2": (1000, 1000000), "unit1":"円", "unit2":"人" },
+    # パターン2: A * r
+    { "pattern": 2, "template": "売上高 <b>{label1}円</b> に対して、営業利益率は <b>{pct}%</b> です。<br>営業利益は？", "range1": (100000000, 1000000000000), "pct_range": (1, 30), "unit1":"円" },
+    { "pattern": 2, "template": "市場規模 <b>{label1}円</b> の業界で、シェア <b>{pct}%</b> を獲得しました。<br>自社の売上は？", "range1": (1000000000, 1000000000000), "pct_range": (1, 60), "unit1":"円" },
+    { "pattern": 2, "template": "予算 <b>{label1}円</b> のうち、すでに <b>{pct}%</b> を消化しました。<br>消化した金額は？", "range1": (1000000, 1000000000), "pct_range": (5, 95), "unit1":"円" },
+    { "pattern": 2, "template": "投資額 <b>{label1}円</b> に対して、リターン（利回り）が <b>{pct}%</b> ありました。<br>利益額は？", "range1": (1000000, 10000000000), "pct_range": (3, 20), "unit1":"円" },
+    # パターン3: A * B * r
+    { "pattern": 3, "template": "単価 <b>{label1}円</b> の商品を <b>{label2}個</b> 販売し、利益率は <b>{pct}%</b> でした。<br>利益額は？", "range1": (100, 20000), "range2": (100, 50000), "pct_range": (5, 40), "unit1":"円", "unit2":"個" },
+    { "pattern": 3, "template": "客単価 <b>{label1}円</b> で <b>{label2}人</b> が来店し、原価率は <b>{pct}%</b> です。<br>原価の総額は？", "range1": (500, 10000), "range2": (100, 50000), "pct_range": (20, 80), "unit1":"円", "unit2":"人" },
+    { "pattern": 3, "template": "案件単価 <b>{label1}円</b> の案件が <b>{label2}件</b> あり、成約率は <b>{pct}%</b> でした。<br>成約による売上合計は？", "range1": (100000, 5000000), "range2": (10, 500), "pct_range": (5, 60), "unit1":"円", "unit2":"件" },
+    # パターン4: A * B(年)
+    { "pattern": 4, "template": "子会社株式の減損テスト。将来CF <b>{label1}円</b> が <b>{label2}</b> 続くと仮定します。<br>割引前のCF総額は？", "range1": (10000000, 5000000000), "range2": (3, 15), "suffix2": "年", "unit1":"円", "unit2":"年間" },
+    { "pattern": 4, "template": "投資案件の評価。年間 <b>{label1}円</b> のリターンが <b>{label2}</b> 継続する見込みです。<br>期間累計のリターンは？", "range1": (1000000, 1000000000), "range2": (3, 20), "suffix2": "年", "unit1":"円", "unit2":"年間" },
+    { "pattern": 4, "template": "新規事業のPL計画。年間固定費 <b>{label1}円</b> が <b>{label2}</b> かかる見通しです。<br>固定費の総額は？", "range1": (5000000, 500000000), "range2": (2, 5), "suffix2": "年", "unit1":"円", "unit2":"年間" }
+]
+
+EXCLUDED_PCT = (10, 50)
+
+def _compile_scenarios():
+    """
+    SCENARIOS から出題用のテーブルを組み立てる (import したときにプロセスで一度だけ呼ぶ)。
+    桁数や % の候補 (10%/50% 除外済み) を前計算しておき、出題時は定数時間で抽選する。
+    """
+    table = []
+    for i, sc in enumerate(SCENARIOS):
+        entry = dict(sc)
+        entry["index"] = i
+        entry["digits1"] = (len(str(sc["range1"][0])), len(str(sc["range1"][1])))
+        if "range2" in sc:
+            entry["digits2"] = (len(str(sc["range2"][0])), len(str(sc["range2"][1])))
+        if "pct_range" in sc:
+            min_p, max_p = sc["pct_range"]
+            entry["pcts"] = tuple(p for p in range(min_p, max_p + 1) if p not in EXCLUDED_PCT)
+            entry["simple_pcts"] = tuple(p for p in range(min_p, max_p + 1, 5) if p not in EXCLUDED_PCT and p != 0) or (5,)
+        table.append(entry)
+    patterns = sorted({e["pattern"] for e in table})
+    by_pattern = {p: tuple(e for e in table if e["pattern"] == p) for p in patterns}
+    excluding = {p: tuple(e for e in table if e["pattern"] != p) for p in patterns}
+    return tuple(table), by_pattern, excluding
+
+_SCENARIO_TABLE, _SCENARIOS_BY_PATTERN, _SCENARIOS_EXCLUDING = _compile_scenarios()
+
+@timed("mental_math_question_generation_seconds", kind="single")
+def generate_question_data(is_advanced=False, force_pattern=None, simple_amounts=None, simple_pct=None, exclude_pattern=None, rng=random, sampler=None):
+    """sampler (AdaptiveSampler) を渡すとその重みで、渡さなければ一様にシナリオを選ぶ"""
+    if simple_amounts is None: simple_amounts = not is_advanced
+    if simple_pct is None: simple_pct = not is_advanced
+
+    if sampler is not None:
+        scenario = sampler.pick(rng, force_pattern, exclude_pattern)
+    else:
+        if force_pattern:
+            candidates = _SCENARIOS_BY_PATTERN[force_pattern]
+        elif exclude_pattern:
+            candidates = _SCENARIOS_EXCLUDING[exclude_pattern]
+        else:
+            candidates = _SCENARIO_TABLE
+        scenario = rng.choice(candidates)
+    pattern = scenario['pattern']
+
+    val1 = _sample_amount(rng, *scenario['range1'], *scenario['digits1'], simple_amounts)
+    val2 = 1
+    pct = 0
+
+    if 'range2' in scenario:
+        val2 = _sample_amount(rng, *scenario['range2'], *scenario['digits2'], simple_amounts)
+
+    if 'pct_range' in scenario:
+        pct = rng.choice(scenario['simple_pcts'] if simple_pct else scenario['pcts'])
+    
+    # 基礎編は単位付き、上級編はカンマ区切り
+    if simple_amounts:
+        label1 = format_number_with_unit_label(val1)
+    else:
+        label1 = f"{val1:,}"
+    
+    label2 = ""
+    suffix2 = scenario.get('suffix2', '')
+    
+    if pattern in [1, 3]:
+        if simple_amounts:
+            label2 = format_number_with_unit_label(val2)
+        else:
+            label2 = f"{val2:,}"
+    elif pattern == 4:
+        label2 = f"{val2}{suffix2}"
+        
+    correct_val = 0
+    if pattern == 1: correct_val = val1 * val2
+    elif pattern == 2: correct_val = val1 * (pct / 100.0)
+    elif pattern == 3: correct_val = val1 * val2 * (pct / 100.0)
+    elif pattern == 4: correct_val = val1 * val2
+
+    q_text = scenario['template'].format(label1=label1, label2=label2, pct=pct)
+    
+    unit1 = scenario.get('unit1', '')
+    unit2 = scenario.get('unit2', '')
+    if pattern == 4: unit2 = suffix2
+    
+    return {
+        "q_text": q_text,
+        "correct": correct_val,
+        "pattern": pattern,
+        "scenario": scenario['index'],
+        "raw_val1": val1, "raw_val2": val2, "raw_pct": pct,
+        "unit1": unit1, "unit2": unit2,
+        "is_advanced": is_advanced
+    }
+
+# ==========================================
+# 出題の重み付け (苦手なシナリオを多めに出す)
+# ==========================================
+def build_alias_table(weights):
+    """
+    Vose のエイリアス法の表 (prob, alias) を O(n) で作る。
+    抽選は添字 i を一様に引き、確率 prob[i] で i、それ以外は alias[i] を返すだけなので O(1)。
+    """
+    n = len(weights)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    prob, alias = [1.0] * n, list(range(n))
+    small = [i for i, w in enumerate(scaled) if w < 1.0]
+    large = [i for i, w in enumerate(scaled) if w >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    # 片方が余るのは丸め誤差で 1 からずれただけなので、確率 1 のまま残す
+    return prob, alias
+
+def alias_draw(table, rng=random):
+    prob, alias = table
+    i = rng.randrange(len(prob))
+    return i if rng.random() < prob[i] else alias[i]
+
+class AdaptiveSampler:
+    """
+    セッションごとの出題の重み。シナリオの重みは ADAPTIVE_FLOOR + 失点率の指数移動平均で、
+    全シナリオが同じ重みなら一様に選ぶのと同じ分布になる。
+    抽選は パターン → パターン内のシナリオ の2段のエイリアス表で O(1)。
+    解答で重みが変わったら、そのパターンの表とパターン間の表だけを次の抽選時に作り直す。
+    """
+    def __init__(self):
+        self.miss = [ADAPTIVE_PRIOR] * len(_SCENARIO_TABLE)
+        self.members = {p: [e["index"] for e in entries] for p, entries in _SCENARIOS_BY_PATTERN.items()}
+        self._pattern_weight = {}
+        self._within = {}
+        self._top = {}  # {除外するパターン: (パターンの並び, エイリアス表)}
+        self._dirty = set(self.members)
+
+    def weight(self, scenario):
+        return ADAPTIVE_FLOOR + self.miss[scenario]
+
+    def update(self, scenario, miss):
+        """scenario (_SCENARIO_TABLE の添字) の解答結果 miss (0 = 満点, 1 = 不正解) を反映する。O(1)"""
+        self.miss[scenario] += ADAPTIVE_ALPHA * (min(max(miss, 0.0), 1.0) - self.miss[scenario])
+        self._dirty.add(_SCENARIO_TABLE[scenario]["pattern"])
+        self._top.clear()
+
+    def _refresh(self):
+        for p in self._dirty:
+            weights = [self.weight(i) for i in self.members[p]]
+            self._within[p] = build_alias_table(weights)
+            self._pattern_weight[p] = sum(weights)
+        self._dirty.clear()
+
+    def pick(self, rng=random, force_pattern=None, exclude_pattern=None):
+        self._refresh()
+        if force_pattern:
+            p = force_pattern
+        else:
+            top = self._top.get(exclude_pattern)
+            if top is None:
+                patterns = [p for p in self.members if p != exclude_pattern]
+                top = self._top[exclude_pattern] = (patterns, build_alias_table([self._pattern_weight[p] for p in patterns]))
+            patterns, table = top
+            p = patterns[alias_draw(table, rng)]
+        return _SCENARIO_TABLE[self.members[p][alias_draw(self._within[p], rng)]]
+
+# ==========================================
+# 問題の一括生成 (NumPy)
+# ==========================================
+def _sample_amounts(rng, min_val, max_val, min_digits, max_digits, simple, size):
+    """_sample_amount と同じ分布の値を size 個まとめて生成する"""
+    if not simple:
+        return rng.integers(min_val, max_val, endpoint=True, size=size)
+    bases = np.asarray(SIMPLE_BASES, dtype=np.int64)[rng.integers(len(SIMPLE_BASES), size=size)]
+    powers = np.maximum(0, rng.integers(min_digits, max_digits, endpoint=True, size=size) - 2)
+    vals = np.clip(bases * 10**powers, min_val, max_val)
+    vals = np.where(vals < 100, vals // 10 * 10, vals)
+    if min_val < 10:
+        raw = rng.integers(min_val, max_val, endpoint=True, size=size)
+        vals = np.where(raw < 10, raw, vals)
+    return vals
+
+def _render_labels(values, fmt):
+    # 同じ値は1回だけ文字列化する (基礎編の丸い数字はほとんど重複する)
+    uniq, inverse = np.unique(values, return_inverse=True)
+    return np.array([fmt(int(v)) for v in uniq], dtype=object)[inverse]
+
+@timed("mental_math_question_generation_seconds", kind="batch")
+def generate_question_batch(n, is_advanced=False, force_pattern=None, simple_amounts=None, simple_pct=None, exclude_pattern=None, seed=None, render=True):
+    """
+    generate_question_data と同じ分布の問題を n 問まとめて生成し、列ごとの配列で返す。
+    seed を指定すると同じ問題セットを再現できる。render=False なら文字列を作らない。
+    """
+    if simple_amounts is None: simple_amounts = not is_advanced
+    if simple_pct is None: simple_pct = not is_advanced
+    rng = np.random.default_rng(seed)
+
+    if force_pattern:
+        candidates = _SCENARIOS_BY_PATTERN[force_pattern]
+    elif exclude_pattern:
+        candidates = _SCENARIOS_EXCLUDING[exclude_pattern]
+    else:
+        candidates = _SCENARIO_TABLE
+
+    choice = rng.integers(len(candidates), size=n)
+    scenario = np.empty(n, dtype=np.int64)
+    pattern = np.empty(n, dtype=np.int64)
+    val1 = np.empty(n, dtype=np.int64)
+    val2 = np.ones(n, dtype=np.int64)
+    pct = np.zeros(n, dtype=np.int64)
+
+    for c, sc in enumerate(candidates):
+        mask = choice == c
+        m = int(mask.sum())
+        if m == 0: continue
+        scenario[mask] = _SCENARIO_TABLE.index(sc)
+        pattern[mask] = sc['pattern']
+        val1[mask] = _sample_amounts(rng, *sc['range1'], *sc['digits1'], simple_amounts, m)
+        if 'range2' in sc:
+            val2[mask] = _sample_amounts(rng, *sc['range2'], *sc['digits2'], simple_amounts, m)
+        if 'pct_range' in sc:
+            domain = np.asarray(sc['simple_pcts'] if simple_pct else sc['pcts'], dtype=np.int64)
+            pct[mask] = domain[rng.integers(len(domain), size=m)]
+
+    # 演算順序を generate_question_data と揃えているので、正解は1問ずつ作った場合と一致する
+    correct = np.where(pattern == 2, val1 * (pct / 100.0),
+              np.where(pattern == 3, val1 * val2 * (pct / 100.0), (val1 * val2).astype(np.float64)))
+
+    batch = {
+        "scenario": scenario, "pattern": pattern,
+        "raw_val1": val1, "raw_val2": val2, "raw_pct": pct,
+        "correct": correct, "is_advanced": is_advanced,
+    }
+    if render:
+        amount_fmt = format_number_with_unit_label if simple_amounts else (lambda v: f"{v:,}")
+        label1 = _render_labels(val1, amount_fmt)
+        label2 = np.full(n, "", dtype=object)
+        has_label2 = (pattern == 1) | (pattern == 3)
+        label2[has_label2] = _render_labels(val2[has_label2], amount_fmt)
+        is_years = pattern == 4
+        suffixes = [sc.get('suffix2', '') for sc in _SCENARIO_TABLE]
+        label2[is_years] = [f"{v}{suffixes[i]}" for i, v in zip(scenario[is_years].tolist(), val2[is_years].tolist())]
+        templates = [sc['template'] for sc in _SCENARIO_TABLE]
+        batch["label1"] = label1
+        batch["label2"] = label2
+        batch["q_text"] = np.array([templates[i].format(label1=l1, label2=l2, pct=p)
+                                    for i, l1, l2, p in zip(scenario.tolist(), label1, label2, pct.tolist())], dtype=object)
+    return batch
+
+def question_from_batch(batch, i):
+    """一括生成した i 問目を generate_question_data と同じ形の dict にする"""
+    sc = _SCENARIO_TABLE[batch["scenario"][i]]
+    pattern = int(batch["pattern"][i])
+    correct = float(batch["correct"][i])
+    return {
+        "q_text": batch["q_text"][i],
+        "correct": correct if pattern in [2, 3] else int(correct),
+        "pattern": pattern,
+        "scenario": int(batch["scenario"][i]),
+        "raw_val1": int(batch["raw_val1"][i]), "raw_val2": int(batch["raw_val2"][i]), "raw_pct": int(batch["raw_pct"][i]),
+        "unit1": sc.get('unit1', ''), "unit2": sc.get('suffix2', '') if pattern == 4 else sc.get('unit2', ''),
+        "is_advanced": batch["is_advanced"]
+    }
+
+# ==========================================
+# フラッシュカード用データ生成
+# ==========================================
+FLASH_RECENT = 10
+
+def _flash_label(v):
+    if v >= 10**8:
+        if v % 10**8 == 0: return f"{v//10**8}億"
+        else: return f"{v//10**8}億{v%10**8}..."
+    elif v >= 10**4:
+        if v % 10**4 == 0: return f"{v//10**4}万"
+    return f"{v:,}"
+
+@st.cache_resource
+def _flashcard_deck():
+    """出題し得る全カード (10^p1 × 10^p2, p1 + p2 <= 13)。表示用の文字列も作っておく"""
+    deck = []
+    for p1 in range(2, 11):
+        for p2 in range(2, 11):
+            if p1 + p2 > 13: continue
+            val1 = 10**p1
+            val2 = 10**p2
+            deck.append({
+                "q_text": f"{_flash_label(val1)} × {_flash_label(val2)}",
+                "correct": val1 * val2,
+                "answer_label": format_japanese_answer(val1 * val2)
+            })
+    return tuple(deck)
+
+def generate_flashcard_data(state=None):
+    """
+    シャッフル済みの山札から1枚引く (O(1))。山札を使い切ったら切り直し、
+    直前の周回の最後 FLASH_RECENT 枚は新しい山札の後ろに回して続けて出ないようにする。
+    """
+    if state is None: state = st.session_state
+    deck = _flashcard_deck()
+    order = state.get("flash_order")
+    cursor = state.get("flash_cursor", 0)
+
+    if not order or cursor >= len(order):
+        recent = set(order[-FLASH_RECENT:]) if order else set()
+        order = list(range(len(deck)))
+        random.shuffle(order)
+        order = [i for i in order if i not in recent] + [i for i in order if i in recent]
+        cursor = 0
+
+    state["flash_order"] = order
+    state["flash_cursor"] = cursor + 1
+    return deck[order[cursor]]
+
+# ==========================================
+# 選択肢・解説の組み立て
+# ==========================================
+def build_quiz_options(q, advanced, rng=random):
+    correct = q['correct']
+    options = [correct]
+    
+    if advanced:
+        multipliers = [0.85, 0.90, 0.95, 1.05, 1.10, 1.15]
+        selected_mults = rng.sample(multipliers, 3)
+        for m in selected_mults:
+            options.append(correct * m)
+    else:
+        if q['pattern'] == 2:
+            options.extend([correct * 0.8, correct * 1.2, correct * 1.5])
+        else:
+            options.append(correct * 10)
+            options.append(correct / 10)
+            options.append(rng.choice([correct * 100, correct / 100, correct * 2]))
+
+    rng.shuffle(options)
+    return options
+
+def build_explanation(q):
+    """(アラビア数字の計算イメージ, 漢数字の式) を返す"""
+    correct_val = q['correct']
+    pattern_used = q['pattern']
+    v1 = q['raw_val1']
+    v2 = q['raw_val2']
+    pct = q['raw_pct']
+    u1 = q['unit1']
+    u2 = q['unit2']
+    
+    calc_str_arabic = ""
+    if pattern_used == 1: calc_str_arabic = f"{v1:,} × {v2:,} = {correct_val:,.0f}"
+    elif pattern_used == 2: calc_str_arabic = f"{v1:,} × {pct}% = {correct_val:,.0f}"
+    elif pattern_used == 3: calc_str_arabic = f"{v1:,} × {v2:,} × {pct}% = {correct_val:,.0f}"
+    elif pattern_used == 4: calc_str_arabic = f"{v1:,} × {v2} = {correct_val:,.0f}"
+
+    f_v1 = format_japanese_answer(v1) + u1
+    f_ans = format_japanese_answer(correct_val) + "円"
+    calc_str_kanji = ""
+    if pattern_used == 1: 
+        f_v2 = format_japanese_answer(v2) + u2
+        calc_str_kanji = f"{f_v1} × {f_v2} ＝ {f_ans}"
+    elif pattern_used == 2: 
+        calc_str_kanji = f"{f_v1} × {pct}% ＝ {f_ans}"
+    elif pattern_used == 3: 
+        f_v2 = format_japanese_answer(v2) + u2
+        calc_str_kanji = f"{f_v1} × {f_v2} × {pct}% ＝ {f_ans}"
+    elif pattern_used == 4: 
+        f_v2 = f"{v2}{u2}"
+        calc_str_kanji = f"{f_v1} × {f_v2} ＝ {f_ans}"
+    return calc_str_arabic, calc_str_kanji
+
+# ==========================================
+# デイリーチャレンジ (全ユーザー共通の問題セット)
+# ==========================================
+@st.cache_resource(max_entries=8)
+def get_daily_challenge(page, day):
+    """
+    その日・そのモードの問題セット (選択肢・解説つき)。日付から決まるシードで
+    プロセスごとに1日1回だけ生成し、全セッションで共有する。読み取り専用として扱うこと。
+    上級編と同じく、7問目以降はパターン3にする。
+    """
+    seed = [int(day.replace("-", "")), list(DAILY_MODES).index(page)]
+    rng = random.Random(f"{day}:{page}")
+    batches = [
+        generate_question_batch(6, is_advanced=True, seed=seed + [0]),
+        generate_question_batch(TOTAL_QUESTIONS - 6, is_advanced=True, force_pattern=3, seed=seed + [1]),
+    ]
+    questions = []
+    for batch in batches:
+        for i in range(len(batch["pattern"])):
+            q = question_from_batch(batch, i)
+            if page == "daily_quiz":
+                q['options'] = build_quiz_options(q, advanced=True, rng=rng)
+                q['option_labels'] = [format_japanese_answer(opt) for opt in q['options']]
+            q['explanation'] = build_explanation(q)
+            questions.append(q)
+    return tuple(questions)
+
+# ==========================================
+# スコア計算
+# ==========================================
+# 誤差(%)がこの値以下なら 10点, 9点, ... 1点。20% を超えると 0点
+SCORE_THRESHOLDS = (2, 4, 6, 8, 10, 12, 14, 16, 18, 20)
+CHOICE_TOLERANCE = 0.01  # 4択モードで正解とみなす比率のずれ
+
+def calculate_score(user_val, correct_val):
+    if correct_val == 0: return 0, 0.0, False
+    diff_pct = abs((user_val - correct_val) / correct_val * 100)
+    is_perfect = (user_val == correct_val)
+    points = 0
+    if diff_pct <= SCORE_THRESHOLDS[-1]:
+        points = 10 - bisect.bisect_left(SCORE_THRESHOLDS, diff_pct)
+    return points, diff_pct, is_perfect
+
+def is_choice_correct(user_val, correct_val):
+    ratio = user_val / correct_val if correct_val != 0 else 0
+    return (1 - CHOICE_TOLERANCE <= ratio <= 1 + CHOICE_TOLERANCE)
+
+def calculate_scores(user_vals, correct_vals):
+    """
+    calculate_score の一括版。(points, diff_pct, is_perfect) をそれぞれ配列で返す。
+    値が 2**53 未満 (このアプリの出題範囲) なら1件ずつ計算した結果と一致する。
+    """
+    user = np.asarray(user_vals, dtype=np.float64)
+    correct = np.asarray(correct_vals, dtype=np.float64)
+    valid = correct != 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        diff_pct = np.where(valid, np.abs((user - correct) / np.where(valid, correct, 1) * 100), 0.0)
+    in_range = valid & (diff_pct <= SCORE_THRESHOLDS[-1])
+    points = np.where(in_range, 10 - np.searchsorted(SCORE_THRESHOLDS, diff_pct, side="left"), 0)
+    is_perfect = valid & (user == correct)
+    return points, diff_pct, is_perfect
+
+def judge_choices(user_vals, correct_vals):
+    """is_choice_correct の一括版"""
+    user = np.asarray(user_vals, dtype=np.float64)
+    correct = np.asarray(correct_vals, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(correct != 0, user / np.where(correct != 0, correct, 1), 0)
+    return (1 - CHOICE_TOLERANCE <= ratio) & (ratio <= 1 + CHOICE_TOLERANCE)
+
+# ==========================================
+# 解答記録の再採点
+# ==========================================
+CHOICE_MODES = ("quiz", "quiz_advanced", "daily_quiz")  # 4択 (正解なら 1点) のモード
+
+def regrade_attempts(directory=None):
+    """
+    解答記録を今の採点基準 (SCORE_THRESHOLDS / CHOICE_TOLERANCE) で一括で採点し直し、モードごとに
+    件数・記録時の平均点・再採点後の平均点・点が変わった件数を返す。採点基準を変えたときの影響の確認用。
+    """
+    cols = load_attempts(["mode", "user", "correct", "points"], directory)
+    choice = np.isin(cols["mode"], [ATTEMPT_MODES.index(m) for m in CHOICE_MODES])
+    points = np.where(choice, judge_choices(cols["user"], cols["correct"]), calculate_scores(cols["user"], cols["correct"])[0])
+    changed = points != cols["points"]
+    size = len(ATTEMPT_MODES)
+    counts = np.bincount(cols["mode"], minlength=size)
+    recorded = np.bincount(cols["mode"], weights=cols["points"], minlength=size)
+    regraded = np.bincount(cols["mode"], weights=points, minlength=size)
+    n_changed = np.bincount(cols["mode"], weights=changed, minlength=size)
+    return [{"mode": page, "count": int(counts[i]), "recorded": recorded[i] / counts[i], "regraded": regraded[i] / counts[i],
+             "changed": int(n_changed[i])} for i, page in enumerate(ATTEMPT_MODES) if counts[i]]
+
+@st.cache_data(ttl=STATS_SNAPSHOT_INTERVAL, show_spinner=False)
+def cached_regrade_attempts():
+    """統計ダッシュボード用。解答記録は増える一方なので、統計と同じ間隔でだけ採点し直す"""
+    return regrade_attempts()
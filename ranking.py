@@ -0,0 +1,911 @@
+"""
+ランキングの保存先 (CSV / SQLite / Redis 互換サーバー) と、その索引・圧縮・バックグラウンドの書き込み。
+
+アプリ・ranking_admin.py・ranking_server.py・ベンチマーク・テストから import して使う。
+索引や接続プール、書き込み用のスレッドはモジュールの変数に置き、プロセスの全セッションで共有する
+(Streamlit のスクリプトと違い、import したモジュールは再実行で読み直されない)。
+pandas は DataFrame を返す関数の中でだけ読み込む。
+"""
+import abc
+import atexit
+import bisect
+import csv
+import gzip
+import heapq
+import io
+import json
+import os
+import queue
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from metrics import METRICS, timed
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+RANKING_FILE = "ranking.csv"
+RANKING_DB = "ranking.db"
+RANKING_BACKEND = os.environ.get("RANKING_BACKEND", "csv")  # "csv", "sqlite" または "redis"
+RANKING_URL = os.environ.get("RANKING_URL", "redis://127.0.0.1:6379/0")  # RANKING_BACKEND=redis の接続先
+RANKING_KEY_PREFIX = os.environ.get("RANKING_KEY_PREFIX", "ranking")  # redis のキーの接頭辞
+RANKING_POOL_SIZE = 8  # プロセスごとに保持しておくアイドル接続の上限
+RANKING_ASYNC = os.environ.get("RANKING_ASYNC", "1") == "1"  # 登録をバックグラウンドでまとめて書き込む
+RANKING_BATCH_WAIT = 0.05  # 秒。同時に来た登録を1回の書き込みにまとめるために待つ時間
+RANKING_BATCH_MAX = 500  # 1回の書き込みにまとめる最大件数
+RANKING_COLUMNS = ["timestamp", "nickname", "mode", "score", "duration"]
+RANKING_TOP_K = 100
+RANKING_PAGE_SIZE = 20
+RANKING_ARCHIVE = "ranking_archive.csv.gz"
+RANKING_RETAIN_TOP_K = int(os.environ.get("RANKING_RETAIN_TOP_K", "1000"))  # 圧縮後もモードごとに残す上位件数
+RANKING_RETAIN_DAYS = int(os.environ.get("RANKING_RETAIN_DAYS", "30"))  # この日数以内の記録は順位に関係なく残す
+# デイリーチャレンジはモード名に日付を入れて、日ごとに別のランキングにする (compact_ranking も日付を読む)
+DAILY_MODES = {"daily_quiz": "デイリー(お気軽)", "daily_training": "デイリー(チャレンジ)"}
+
+def daily_mode_name(page, day):
+    return f"{DAILY_MODES[page]} {day}"
+
+# ==========================================
+# CSV (RANKING_BACKEND=csv) と共通の索引
+# ==========================================
+@contextmanager
+def file_lock(lock_path):
+    """lock_path のファイルを使ってプロセス間で直列化する排他ロック"""
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+def ranking_lock(path=None):
+    """
+    ランキングファイルへの書き込みをプロセス間で直列化する排他ロック。
+    データ本体ではなく隣の .lock ファイルをロックするので、本体を置き換えても有効。
+    """
+    return file_lock((path or RANKING_FILE) + ".lock")
+
+def _format_csv_rows(rows):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows(rows)
+    return buf.getvalue()
+
+def _append_ranking_rows(rows):
+    """
+    行をファイル末尾に追記する (O(1))。1回の write + fsync で書き込み、
+    クラッシュで途中まで書かれた行が残っていても改行で切り離してから追記する。
+    戻り値は (追記前, 追記後) のファイルキー。
+    """
+    data = _format_csv_rows(rows)
+    with ranking_lock():
+        fd = os.open(RANKING_FILE, os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            before = os.fstat(fd)
+            size = before.st_size
+            if size == 0:
+                data = _format_csv_rows([RANKING_COLUMNS]) + data
+            else:
+                os.lseek(fd, size - 1, os.SEEK_SET)
+                if os.read(fd, 1) != b"\n":
+                    data = "\n" + data
+            payload = data.encode("utf-8")
+            while payload:
+                written = os.write(fd, payload)
+                payload = payload[written:]
+            os.fsync(fd)
+            return _stat_key(before), _stat_key(os.fstat(fd))
+        finally:
+            os.close(fd)
+
+class ModeLeaderboard:
+    """
+    1モード分のランキング索引。(-score, duration, 登録順) でソート済みのキー列を保持し、
+    挿入と順位の問い合わせを二分探索で行う。
+    """
+    def __init__(self):
+        self._keys = []
+        self._rows = []
+        self._seq = 0
+
+    @classmethod
+    def from_sorted(cls, keys, rows):
+        board = cls()
+        board._keys = keys
+        board._rows = rows
+        board._seq = max((k[2] for k in keys), default=-1) + 1
+        return board
+
+    def __len__(self):
+        return len(self._keys)
+
+    def insert(self, row, seq=None):
+        """seq は登録順 (全モード共通の通し番号)。省略するとこのモードの中での連番を使う"""
+        seq = self._seq if seq is None else seq
+        self._seq = max(self._seq, seq) + 1
+        key = (-int(row["score"]), float(row["duration"]), seq)
+        i = bisect.bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._rows.insert(i, row)
+
+    def top(self, k=None, offset=0):
+        return self._rows[offset:None if k is None else offset + k]
+
+    def items(self):
+        return zip(self._keys, self._rows)
+
+    def rank(self, score, duration):
+        # 自分より (スコアが高い or 同点でタイムが速い) 人数 + 1
+        return bisect.bisect_left(self._keys, (-int(score), float(duration))) + 1
+
+# プロセスで共有する CSV の索引と DataFrame (key はそれを作ったときのファイルキー)
+_RANKING_CACHE = {"lock": threading.Lock(), "key": None, "df": None, "boards": None, "next_seq": 0}
+
+def _stat_key(stat):
+    return (os.path.abspath(RANKING_FILE), stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def _ranking_file_key():
+    try:
+        return _stat_key(os.stat(RANKING_FILE))
+    except FileNotFoundError:
+        return None
+
+def _read_ranking_file():
+    """
+    ranking.csv を行の辞書のリストで読む。索引づくりに pandas は使わない。
+    書き込み途中で切れた行 (列が足りない・数値が読めない) は捨てる。
+    """
+    if not os.path.exists(RANKING_FILE) or os.path.getsize(RANKING_FILE) == 0:
+        return []
+    t0 = time.perf_counter()
+    size = os.path.getsize(RANKING_FILE)
+    rows = []
+    with open(RANKING_FILE, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or RANKING_COLUMNS
+        i_ts, i_nick, i_mode, i_score, i_dur = (header.index(c) for c in RANKING_COLUMNS)
+        width = len(header)
+        for rec in reader:
+            if len(rec) != width:
+                continue
+            try:
+                score = int(float(rec[i_score]))
+                duration = float(rec[i_dur])
+            except ValueError:
+                continue
+            rows.append({"timestamp": rec[i_ts], "nickname": rec[i_nick], "mode": rec[i_mode], "score": score, "duration": duration})
+    METRICS.observe("mental_math_ranking_parse_seconds", time.perf_counter() - t0)
+    METRICS.inc("mental_math_ranking_loads_total")
+    METRICS.set("mental_math_ranking_rows", len(rows))
+    METRICS.set("mental_math_ranking_file_bytes", size)
+    return rows
+
+def _read_ranking_frame():
+    # DataFrame が欲しい呼び出し元 (load_ranking) 向け。この場合だけ pandas でまとめてパースする
+    import pandas as pd
+    if not os.path.exists(RANKING_FILE) or os.path.getsize(RANKING_FILE) == 0:
+        return pd.DataFrame(columns=RANKING_COLUMNS)
+    df = pd.read_csv(RANKING_FILE, on_bad_lines="skip", dtype={"nickname": str})
+    df = df.dropna(subset=["score", "duration"]).reset_index(drop=True)
+    df["score"] = df["score"].astype(int)
+    return df
+
+def _build_leaderboards(rows):
+    per_mode = {}
+    for seq, row in enumerate(rows):
+        per_mode.setdefault(row["mode"], []).append(((-row["score"], row["duration"], seq), row))
+    boards = {}
+    for mode, items in per_mode.items():
+        items.sort(key=lambda kr: kr[0])
+        boards[mode] = ModeLeaderboard.from_sorted([k for k, _ in items], [r for _, r in items])
+    return boards
+
+def _refresh_ranking_cache(cache):
+    # cache["lock"] を保持した状態で呼ぶこと
+    key = _ranking_file_key()
+    if cache["key"] != key:
+        cache["key"] = key
+        cache["df"] = None
+        cache["boards"] = None
+    if cache["boards"] is None:
+        rows = _read_ranking_file()
+        cache["boards"] = _build_leaderboards(rows)
+        cache["next_seq"] = len(rows)
+
+def invalidate_ranking_cache():
+    cache = _RANKING_CACHE
+    with cache["lock"]:
+        cache["key"] = None
+        cache["df"] = None
+        cache["boards"] = None
+
+class RankingStore(abc.ABC):
+    """
+    ランキングの保存先の共通インターフェース。行は RANKING_COLUMNS をキーにした辞書で、
+    順位は (スコアの降順, タイムの昇順, 登録順) で決める。
+    実装は RANKING_STORES に登録し、RANKING_BACKEND で選ぶ。
+    """
+    name = None
+
+    @abc.abstractmethod
+    def insert(self, rows):
+        """rows (行の辞書のリスト) をまとめて1回で書き込む"""
+
+    @abc.abstractmethod
+    def top(self, mode=None, k=None, offset=0):
+        """mode (None なら全モード) の offset 位から k 件 (None なら最後まで) を順位順で返す"""
+
+    @abc.abstractmethod
+    def count(self, mode=None):
+        """mode (None なら全モード) の登録件数"""
+
+    @abc.abstractmethod
+    def position(self, mode, score, duration):
+        """(順位, 登録人数) を返す"""
+
+    @abc.abstractmethod
+    def frame(self):
+        """全件を登録順の DataFrame で返す (集計・書き出し用)"""
+
+class CsvRankingStore(RankingStore):
+    """
+    RANKING_FILE に追記する CSV。索引はプロセスごとに持ち、ファイルの識別子・更新時刻・
+    サイズが変わらない限り再パースしない。1台のサーバー (同じディスク) の中でだけ共有できる。
+    """
+    name = "csv"
+
+    def insert(self, rows):
+        # 追記 (ファイルロック待ちと fsync) は cache["lock"] の外で行い、その間も表示や順位の問い合わせを止めない
+        before, after = _append_ranking_rows([[row[c] for c in RANKING_COLUMNS] for row in rows])
+        cache = _RANKING_CACHE
+        with cache["lock"]:
+            if cache["boards"] is not None and cache["key"] == before:
+                # 索引が追記直前のファイルのものなら (他の追記や読み直しが挟まっていなければ) 差分更新する
+                for row in rows:
+                    cache["boards"].setdefault(row["mode"], ModeLeaderboard()).insert(row, cache["next_seq"])
+                    cache["next_seq"] += 1
+                cache["key"] = after
+                cache["df"] = None
+            else:
+                cache["key"] = None
+                cache["df"] = None
+                cache["boards"] = None
+
+    def top(self, mode=None, k=None, offset=0):
+        cache = _RANKING_CACHE
+        with cache["lock"]:
+            _refresh_ranking_cache(cache)
+            boards = cache["boards"]
+            if mode is not None:
+                board = boards.get(mode)
+                return board.top(k, offset) if board else []
+            # キーの3番目はファイル内の通し番号なので、同点・同タイムも他のバックエンドと同じく登録順になる
+            merged = heapq.merge(*(b.items() for b in boards.values()), key=lambda kr: kr[0])
+            return [row for _, row in list(merged)[offset:None if k is None else offset + k]]
+
+    def count(self, mode=None):
+        cache = _RANKING_CACHE
+        with cache["lock"]:
+            _refresh_ranking_cache(cache)
+            boards = cache["boards"]
+            if mode is not None:
+                return len(boards.get(mode, ()))
+            return sum(len(b) for b in boards.values())
+
+    def position(self, mode, score, duration):
+        cache = _RANKING_CACHE
+        with cache["lock"]:
+            _refresh_ranking_cache(cache)
+            board = cache["boards"].get(mode)
+            if board is None:
+                return 1, 0
+            return board.rank(score, duration), len(board)
+
+    def frame(self):
+        cache = _RANKING_CACHE
+        with cache["lock"]:
+            key = _ranking_file_key()
+            if cache["key"] != key:
+                cache["key"] = key
+                cache["boards"] = None
+                cache["df"] = None
+            if cache["df"] is None:
+                cache["df"] = _read_ranking_frame()
+            return cache["df"]
+
+# ------------------------------------------
+# 保持期間と圧縮 (ranking_admin.py compact)
+# ------------------------------------------
+def _daily_mode_day(mode):
+    """daily_mode_name で作ったモード名ならその日付 ("YYYY-MM-DD")、それ以外は None"""
+    base, _, day = mode.rpartition(" ")
+    return day if base in DAILY_MODES.values() else None
+
+def _select_retained(records, header, top_k, cutoff):
+    """
+    残す行の番号の集合。モードごとの上位 top_k 件と、cutoff 以降に登録された行。
+    デイリーはモード名に日付が入り毎日新しいモードになるので、cutoff より前の日付のモードは上位も残さない。
+    """
+    i_ts, _, i_mode, i_score, i_dur = (header.index(c) for c in RANKING_COLUMNS)
+    per_mode = {}
+    keep = set()
+    for seq, rec in enumerate(records):
+        per_mode.setdefault(rec[i_mode], []).append((-int(float(rec[i_score])), float(rec[i_dur]), seq))
+        if rec[i_ts] >= cutoff:  # "%Y-%m-%d %H:%M" は文字列の大小が日時の前後と一致する
+            keep.add(seq)
+    for mode, keys in per_mode.items():
+        day = _daily_mode_day(mode)
+        if day is not None and day < cutoff[:10]:
+            continue
+        keep.update(k[2] for k in heapq.nsmallest(top_k, keys))
+    return keep
+
+def _is_valid_record(rec, header):
+    if len(rec) != len(header):
+        return False
+    try:
+        float(rec[header.index("score")])
+        float(rec[header.index("duration")])
+    except ValueError:
+        return False
+    return True
+
+def compact_ranking(csv_path=None, archive_path=RANKING_ARCHIVE, top_k=None, days=None, now=None):
+    """
+    ランキングファイルをリーダーボードに必要な行だけに書き直し、外した行は gzip の
+    アーカイブに追記する。ランキングのロックを取って一時ファイルに書き、os.replace で
+    差し替えるので、アプリが動いたままでも実行できる (読み込み中のプロセスは古いファイルを
+    最後まで読み、次の読み込みでファイルキーの変化に気づいて読み直す)。
+    戻り値は {"kept": 残した行数, "archived": アーカイブした行数, "dropped": 壊れていて捨てた行数}。
+    """
+    csv_path = csv_path or RANKING_FILE
+    top_k = RANKING_RETAIN_TOP_K if top_k is None else top_k
+    days = RANKING_RETAIN_DAYS if days is None else days
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M")
+
+    with ranking_lock(csv_path):
+        if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+            return {"kept": 0, "archived": 0, "dropped": 0}
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            records, dropped = [], 0
+            for rec in reader:
+                if _is_valid_record(rec, header):
+                    records.append(rec)
+                else:
+                    dropped += 1  # 書き込み途中で切れた行はアーカイブにも残さない
+        keep = _select_retained(records, header, top_k, cutoff)
+        kept = [rec for seq, rec in enumerate(records) if seq in keep]
+        evicted = [rec for seq, rec in enumerate(records) if seq not in keep]
+
+        # 先にアーカイブへ書く (差し替え前に落ちても行は失われない。重複はあり得る)
+        if evicted:
+            new_archive = not os.path.exists(archive_path) or os.path.getsize(archive_path) == 0
+            with open(archive_path, "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as gz:  # 追記のたびに gzip のメンバーが増える
+                    gz.write(_format_csv_rows(([header] if new_archive else []) + evicted).encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+        tmp = f"{csv_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            f.write(_format_csv_rows([header] + kept))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, csv_path)
+    return {"kept": len(kept), "archived": len(evicted), "dropped": dropped}
+
+# ------------------------------------------
+# SQLite バックエンド (RANKING_BACKEND=sqlite)
+# ------------------------------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ranking (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    nickname TEXT,
+    mode TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ranking_leaderboard
+    ON ranking (mode, score DESC, duration ASC, id, nickname, timestamp);
+"""
+# (モード, スコア) ごとの件数。ranking への追加・削除と同じトランザクションでトリガーが更新するので、
+# 件数や「自分より高いスコアの人数」を行数によらず数行の読み込みで求められる
+SQLITE_COUNTS_SCHEMA = (
+    """CREATE TABLE ranking_counts (
+        mode TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (mode, score)
+    ) WITHOUT ROWID""",
+    """CREATE TRIGGER ranking_counts_insert AFTER INSERT ON ranking BEGIN
+        INSERT INTO ranking_counts (mode, score, n) VALUES (NEW.mode, NEW.score, 1)
+            ON CONFLICT (mode, score) DO UPDATE SET n = n + 1;
+    END""",
+    """CREATE TRIGGER ranking_counts_delete AFTER DELETE ON ranking BEGIN
+        UPDATE ranking_counts SET n = n - 1 WHERE mode = OLD.mode AND score = OLD.score;
+    END""",
+)
+
+_SQLITE_POOL = {"path": None, "idle": queue.LifoQueue()}  # RANKING_DB が変わったら作り直す
+
+def _open_sqlite(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SQLITE_SCHEMA)
+    if not _has_sqlite_table(conn, "ranking_counts"):
+        # 件数表のない DB (古い版で作ったもの) は、表を作ってから既存の行を数えて埋める。
+        # 他のプロセスと二重に作らないよう、書き込みロックを取ってから確かめ直す
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not _has_sqlite_table(conn, "ranking_counts"):
+                for statement in SQLITE_COUNTS_SCHEMA:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO ranking_counts (mode, score, n) SELECT mode, score, COUNT(*) FROM ranking GROUP BY mode, score")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return conn
+
+def _has_sqlite_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+@contextmanager
+def _sqlite_connection():
+    """接続をプールから借りる。WAL なので読み手と書き手が互いにブロックしない"""
+    pool = _SQLITE_POOL
+    path = os.path.abspath(RANKING_DB)
+    if pool["path"] != path:
+        pool["path"] = path
+        pool["idle"] = queue.LifoQueue()
+    idle = pool["idle"]
+    try:
+        conn = idle.get_nowait()
+    except queue.Empty:
+        conn = _open_sqlite(path)
+        METRICS.inc("mental_math_ranking_connections_total", backend="sqlite")
+    try:
+        yield conn
+    finally:
+        idle.put(conn)
+
+class SqliteRankingStore(RankingStore):
+    """RANKING_DB の SQLite。同じディスクを見る複数プロセスで共有でき、順位は索引で DB 側が求める"""
+    name = "sqlite"
+
+    def insert(self, rows):
+        with _sqlite_connection() as conn, conn:
+            conn.executemany(
+                "INSERT INTO ranking (timestamp, nickname, mode, score, duration) VALUES (?, ?, ?, ?, ?)",
+                [tuple(r[c] for c in RANKING_COLUMNS) for r in rows],
+            )
+
+    def top(self, mode=None, k=None, offset=0):
+        sql = f"SELECT {', '.join(RANKING_COLUMNS)} FROM ranking"
+        params = []
+        if mode is not None:
+            sql += " WHERE mode = ?"
+            params.append(mode)
+        sql += " ORDER BY score DESC, duration ASC, id ASC LIMIT ? OFFSET ?"
+        params += [-1 if k is None else k, offset]
+        with _sqlite_connection() as conn:
+            cur = conn.execute(sql, params)
+            return [dict(zip(RANKING_COLUMNS, r)) for r in cur.fetchall()]
+
+    def count(self, mode=None):
+        with _sqlite_connection() as conn:
+            if mode is None:
+                return conn.execute("SELECT COALESCE(SUM(n), 0) FROM ranking_counts").fetchone()[0]
+            return conn.execute("SELECT COALESCE(SUM(n), 0) FROM ranking_counts WHERE mode = ?", (mode,)).fetchone()[0]
+
+    def position(self, mode, score, duration):
+        # 自分より高いスコアの人数と登録人数は件数表から、同点でタイムが速い人数だけを索引の範囲で数える
+        with _sqlite_connection() as conn:
+            higher, total = conn.execute(
+                "SELECT COALESCE(SUM(CASE WHEN score > ? THEN n END), 0), COALESCE(SUM(n), 0) FROM ranking_counts WHERE mode = ?",
+                (int(score), mode),
+            ).fetchone()
+            faster = conn.execute(
+                "SELECT COUNT(*) FROM ranking WHERE mode = ? AND score = ? AND duration < ?",
+                (mode, int(score), float(duration)),
+            ).fetchone()[0]
+        return higher + faster + 1, total
+
+    def frame(self):
+        import pandas as pd
+        with _sqlite_connection() as conn:
+            return pd.read_sql_query(f"SELECT {', '.join(RANKING_COLUMNS)} FROM ranking ORDER BY id", conn)
+
+# ------------------------------------------
+# Redis バックエンド (RANKING_BACKEND=redis)
+# 複数台のサーバーで1つのランキングを共有する。開発・試験では ranking_server.py で代用できる
+# ------------------------------------------
+class RespError(Exception):
+    """サーバーがエラー応答 (-ERR ...) を返した"""
+
+class RespConnection:
+    """RESP (Redis のプロトコル) の最小クライアント。コマンドはまとめて送って往復を減らせる"""
+    def __init__(self, url, timeout=5):
+        parts = urllib.parse.urlsplit(url)
+        self.sock = socket.create_connection((parts.hostname or "127.0.0.1", parts.port or 6379), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        self.broken = False
+        if parts.password:
+            self.execute("AUTH", *([parts.username] if parts.username else []), parts.password)
+        db = parts.path.strip("/")
+        if db and db != "0":
+            self.execute("SELECT", db)
+
+    def pipeline(self, commands):
+        """commands (引数のタプルのリスト) を1回で送り、返信のリストを返す"""
+        self.broken = True  # 途中で例外が出たら返信の読み残しがあるので、プールに戻さない
+        out = []
+        for args in commands:
+            out.append(b"*%d\r\n" % len(args))
+            for a in args:
+                a = a if isinstance(a, bytes) else str(a).encode("utf-8")
+                out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        self.sock.sendall(b"".join(out))
+        replies = [self._read() for _ in commands]
+        self.broken = False
+        for r in replies:
+            # MULTI/EXEC では EXEC の返信 (配列) の中にエラーが入る
+            for item in r if isinstance(r, list) else [r]:
+                if isinstance(item, RespError):
+                    raise item
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("ランキングサーバーとの接続が切れました")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            return RespError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            n = int(body)
+            if n < 0:
+                return None
+            data = self.reader.read(n + 2)
+            if len(data) != n + 2:
+                raise ConnectionError("ランキングサーバーとの接続が切れました")
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            n = int(body)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise ConnectionError(f"RESP として読めない返信です: {line!r}")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+_REDIS_POOL = {"url": None, "idle": queue.LifoQueue()}  # RANKING_URL が変わったら作り直す
+
+@contextmanager
+def _redis_connection(fresh=False):
+    """接続をプールから借りる。壊れた接続と RANKING_POOL_SIZE を超えた分は戻さずに閉じる"""
+    pool = _REDIS_POOL
+    if pool["url"] != RANKING_URL:
+        pool["url"] = RANKING_URL
+        pool["idle"] = queue.LifoQueue()
+    idle = pool["idle"]
+    conn = None
+    if not fresh:
+        try:
+            conn = idle.get_nowait()
+        except queue.Empty:
+            pass
+    if conn is None:
+        conn = RespConnection(RANKING_URL)
+        METRICS.inc("mental_math_ranking_connections_total", backend="redis")
+    try:
+        yield conn
+    finally:
+        if conn.broken or idle.qsize() >= RANKING_POOL_SIZE:
+            conn.close()
+        else:
+            idle.put(conn)
+
+def _redis_pipeline(*commands):
+    # プールの接続はサーバーの再起動などで切れていることがあるので、新しい接続で1回だけやり直す
+    try:
+        with _redis_connection() as conn:
+            return conn.pipeline(commands)
+    except OSError:
+        with _redis_connection(fresh=True) as conn:
+            return conn.pipeline(commands)
+
+def _redis_transaction(*commands):
+    """commands を MULTI/EXEC で1往復にまとめて実行し、各コマンドの返信のリストを返す"""
+    return _redis_pipeline(("MULTI",), *commands, ("EXEC",))[-1]
+
+def _redis_key(*parts):
+    return ":".join((RANKING_KEY_PREFIX,) + tuple(str(p) for p in parts))
+
+def _redis_member(duration, row_id):
+    """
+    順位用の集合のメンバー。同じスコアの中ではメンバーの文字列順に並ぶので、タイム (0 以上の
+    double をビッグエンディアンの16進にしたもの。大小と文字列順が一致する) と ID を丸めずにつなぐ
+    """
+    return f"{struct.pack('>d', float(duration)).hex()}:{row_id}"
+
+class RedisRankingStore(RankingStore):
+    """
+    Redis (互換サーバー) のソート済み集合。行の本体は <接頭辞>:rows のハッシュに ID で置く。
+    <接頭辞>:all と <接頭辞>:mode:<モード> はスコアの符号を反転した値を集合のスコアに、
+    _redis_member をメンバーにして (スコアの降順, タイムの昇順, 登録順) に並べる。
+    順位の問い合わせ用に、<接頭辞>:mode:<モード>:score:<スコア> にタイムをそのまま集合のスコアにして持つ。
+    ID は登録順が文字列順と一致するよう 0 埋めする。
+    """
+    name = "redis"
+
+    def insert(self, rows):
+        last = _redis_pipeline(("INCRBY", _redis_key("seq"), len(rows)))[0]
+        fields, all_members, per_mode, per_score = [], [], {}, {}
+        for i, row in zip(range(last - len(rows) + 1, last + 1), rows):
+            row_id = f"{i:012d}"
+            score, duration = int(row["score"]), float(row["duration"])
+            member = _redis_member(duration, row_id)
+            fields += [row_id, json.dumps({c: row[c] for c in RANKING_COLUMNS}, ensure_ascii=False)]
+            all_members += [-score, member]
+            per_mode.setdefault(row["mode"], []).extend([-score, member])
+            per_score.setdefault((row["mode"], score), []).extend([repr(duration), row_id])
+        # ID の採番以外は MULTI/EXEC でまとめて反映するので、読み手から書きかけの状態は見えない
+        _redis_transaction(
+            ("HSET", _redis_key("rows"), *fields),
+            ("ZADD", _redis_key("all"), *all_members),
+            *(("ZADD", _redis_key("mode", mode), *members) for mode, members in per_mode.items()),
+            *(("ZADD", _redis_key("mode", mode, "score", score), *members) for (mode, score), members in per_score.items()),
+        )
+
+    def _set_key(self, mode):
+        return _redis_key("all") if mode is None else _redis_key("mode", mode)
+
+    def top(self, mode=None, k=None, offset=0):
+        stop = -1 if k is None else offset + k - 1
+        if k == 0:
+            return []
+        members = _redis_pipeline(("ZRANGE", self._set_key(mode), offset, stop))[0]
+        if not members:
+            return []
+        ids = [m.rsplit(":", 1)[1] for m in members]
+        values = _redis_pipeline(("HMGET", _redis_key("rows"), *ids))[0]
+        return [json.loads(v) for v in values if v is not None]
+
+    def count(self, mode=None):
+        return _redis_pipeline(("ZCARD", self._set_key(mode)))[0]
+
+    def position(self, mode, score, duration):
+        # 自分より (スコアが高い) 人数 + (同点でタイムが速い) 人数 + 1
+        key = self._set_key(mode)
+        higher, faster, total = _redis_pipeline(
+            ("ZCOUNT", key, "-inf", f"({-int(score)}"),
+            ("ZCOUNT", _redis_key("mode", mode, "score", int(score)), "-inf", f"({float(duration)!r}"),
+            ("ZCARD", key),
+        )
+        return higher + faster + 1, total
+
+    def frame(self):
+        import pandas as pd
+        flat = _redis_pipeline(("HGETALL", _redis_key("rows")))[0] or []
+        rows = [json.loads(v) for _, v in sorted(zip(flat[::2], flat[1::2]))]
+        return pd.DataFrame(rows, columns=RANKING_COLUMNS)
+
+# ------------------------------------------
+# ランキングの窓口 (画面からはこれらの関数だけを使う)
+# ------------------------------------------
+RANKING_STORES = {store.name: store for store in (CsvRankingStore, SqliteRankingStore, RedisRankingStore)}
+
+def ranking_store(backend=None):
+    """RANKING_BACKEND (または backend) のストアを返す。状態は各バックエンドのモジュール変数にある"""
+    backend = backend or RANKING_BACKEND
+    try:
+        return RANKING_STORES[backend]()
+    except KeyError:
+        raise ValueError(f"RANKING_BACKEND が不正です: {backend!r} (使えるのは {', '.join(RANKING_STORES)})") from None
+
+def load_ranking(mode=None, limit=None):
+    """
+    ランキングを DataFrame で返す。mode / limit を指定するとそのモードの上位 limit 件を
+    順位順で返す (SQLite / Redis ではフィルタ・並び替え・件数の制限をサーバー側で行う)。
+    CSV の全件は全セッション・全タブで共有し、ファイルの識別子・更新時刻・サイズが
+    変わらない限り再パースしない。返り値は共有オブジェクトなので変更しないこと。
+    """
+    import pandas as pd
+    if mode is not None or limit is not None:
+        return pd.DataFrame(ranking_top(mode, limit), columns=RANKING_COLUMNS)
+    return ranking_store().frame()
+
+def ranking_top(mode=None, k=RANKING_TOP_K, offset=0):
+    return ranking_store().top(mode, k, offset)
+
+def ranking_count(mode=None):
+    return ranking_store().count(mode)
+
+@timed("mental_math_ranking_save_seconds")
+def save_ranking(nickname, mode, score, duration):
+    row = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M"), "nickname": nickname, "mode": mode, "score": score, "duration": duration}
+    ranking_store().insert([row])
+
+# ------------------------------------------
+# バックグラウンドの書き込み (グループコミット)
+# 登録ボタンは書き込みを待たずに戻り、書き込み用のスレッドが溜まった登録をまとめて1回で書く
+# (CSV は1回の fsync、SQLite は1トランザクション、Redis は1往復)
+# ------------------------------------------
+class RankingWriter(threading.Thread):
+    """
+    書き込み待ちの登録をまとめて書くスレッド。書き終わるまで pending に残しておくので、
+    その間に登録した人の順位の見込みにも含まれる。stop されたら残りを書いてから終わる。
+    """
+    def __init__(self):
+        super().__init__(name="ranking-writer", daemon=True)
+        self.cond = threading.Condition()
+        self.pending = []  # [(ストア, 行)]
+        self.stopping = False
+
+    def submit(self, store, row):
+        """
+        row を書き込み待ちに入れ、同じモードの書き込み待ちの行を返す (順位の見込み用)。
+        stop の後は受け付けずに None を返すので、呼び出し元がその場で書くこと (スレッドは既に終わっているかもしれない)。
+        """
+        with self.cond:
+            if self.stopping:
+                return None
+            ahead = [other for _, other in self.pending if other["mode"] == row["mode"]]
+            self.pending.append((store, row))
+            self.cond.notify_all()
+        return ahead
+
+    def flush(self, timeout=None):
+        """書き込み待ちがなくなるまで待つ。待ちきれたら True"""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending, timeout)
+
+    def stop(self, timeout=10):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.join(timeout)
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.pending and not self.stopping:
+                self.cond.wait()
+            # 少しだけ待って、同時に来た登録を1回の書き込みにまとめる
+            deadline = time.monotonic() + RANKING_BATCH_WAIT
+            while self.pending and len(self.pending) < RANKING_BATCH_MAX and not self.stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            METRICS.set("mental_math_ranking_queue_depth", len(self.pending))
+            return self.pending[:RANKING_BATCH_MAX]
+
+    def _commit(self, batch):
+        groups = {}
+        for store, row in batch:
+            groups.setdefault(store.name, (store, []))[1].append(row)
+        for store, rows in groups.values():
+            store.insert(rows)
+
+    def run(self):
+        failures = 0
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            t0 = time.perf_counter()
+            try:
+                self._commit(batch)
+            except Exception as e:
+                failures += 1
+                METRICS.inc("mental_math_ranking_write_errors_total")
+                if not (self.stopping and failures >= 3):
+                    time.sleep(min(0.1 * 2**failures, 5))  # 失敗した分は捨てずに、間を置いてやり直す
+                    continue
+                # 終了時に書けなければ、せめて内容を残して諦める
+                print(f"ランキングの {len(batch)} 件を書き込めませんでした ({type(e).__name__}: {e}): "
+                      f"{[row for _, row in batch]}", file=sys.stderr)
+            else:
+                METRICS.observe("mental_math_ranking_save_seconds", time.perf_counter() - t0)
+                METRICS.observe("mental_math_ranking_batch_rows", len(batch))
+            failures = 0
+            with self.cond:
+                del self.pending[:len(batch)]
+                self.cond.notify_all()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _ranking_writer():
+    """プロセスで1つの書き込み用のスレッド。最初の登録のときに起動する"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = RankingWriter()
+            _writer.start()
+            atexit.register(_writer.stop)  # プロセス終了時に書き込み待ちを書き切る
+        return _writer
+
+def submit_ranking(nickname, mode, score, duration):
+    """
+    ランキングに登録し、書き込みを待たずに (順位, 登録人数) の見込みを返す。
+    見込みはストアの順位に、まだ書き込まれていない登録のうち同じモードで自分より上の件数を足したもの
+    (書き込みの完了とちょうど重なると1つずれることがある)。
+    """
+    store = ranking_store()
+    writer = _ranking_writer() if RANKING_ASYNC else None
+    if writer is not None:
+        row = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M"), "nickname": nickname, "mode": mode, "score": score, "duration": duration}
+        rank, total = store.position(mode, score, duration)
+        ahead = writer.submit(store, row)
+        if ahead is not None:
+            mine = (-int(score), float(duration))
+            rank += sum((-int(other["score"]), float(other["duration"])) < mine for other in ahead)
+            return rank, total + len(ahead) + 1
+    # 非同期にしない設定か、終了処理で書き込み用のスレッドが止まった後はその場で書く
+    save_ranking(nickname, mode, score, duration)
+    return store.position(mode, score, duration)
+
+def migrate_ranking_csv(csv_path=RANKING_FILE, backend=None, batch_size=10000):
+    """
+    既存の ranking.csv をストア (既定は RANKING_BACKEND) に一括で入れる。
+    移行先に既にデータがある場合は何もしない。戻り値は移行した行数。
+    """
+    store = ranking_store(backend)
+    if store.count() > 0:
+        return 0
+    count = 0
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        batch = []
+        for rec in csv.DictReader(f):
+            try:
+                batch.append({"timestamp": rec["timestamp"], "nickname": rec["nickname"], "mode": rec["mode"],
+                              "score": int(float(rec["score"])), "duration": float(rec["duration"])})
+            except (TypeError, ValueError):
+                continue  # 書き込み途中で切れた行
+            if len(batch) >= batch_size:
+                store.insert(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            store.insert(batch)
+            count += len(batch)
+    return count
@@ -0,0 +1,56 @@
+"""
+ランキングデータの保守用コマンド。
+
+    python ranking_admin.py migrate [--csv ranking.csv] [--db ranking.db]
+    python ranking_admin.py migrate --to redis [--url redis://127.0.0.1:6379/0]
+    python ranking_admin.py compact [--csv ranking.csv] [--archive ranking_archive.csv.gz] [--top-k 1000] [--days 30]
+"""
+import argparse
+
+import ranking
+
+
+def cmd_migrate(args):
+    if args.to == "sqlite":
+        target = ranking.RANKING_DB = args.db
+    else:
+        target = ranking.RANKING_URL = args.url
+    count = ranking.migrate_ranking_csv(args.csv, args.to)
+    if count:
+        print(f"{args.csv} から {count} 件を {target} に移行しました。")
+        print(f"RANKING_BACKEND={args.to} を設定してアプリを再起動してください。")
+    else:
+        print(f"{target} には既にデータがあるため、移行をスキップしました。")
+
+
+def cmd_compact(args):
+    result = ranking.compact_ranking(args.csv, args.archive, top_k=args.top_k, days=args.days)
+    print(f"{args.csv}: {result['kept']} 件を残し、{result['archived']} 件を {args.archive} に移しました。")
+    if result["dropped"]:
+        print(f"壊れた行 {result['dropped']} 件を捨てました。")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビジネス暗算道場 ランキング保守ツール")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="ranking.csv を SQLite / Redis に移行する")
+    p.add_argument("--csv", default=ranking.RANKING_FILE)
+    p.add_argument("--to", choices=["sqlite", "redis"], default="sqlite")
+    p.add_argument("--db", default=ranking.RANKING_DB, help="移行先の SQLite ファイル (--to sqlite)")
+    p.add_argument("--url", default=ranking.RANKING_URL, help="移行先のサーバー (--to redis)")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("compact", help="ranking.csv を上位・最近の記録だけに絞り、残りをアーカイブする")
+    p.add_argument("--csv", default=ranking.RANKING_FILE)
+    p.add_argument("--archive", default=ranking.RANKING_ARCHIVE)
+    p.add_argument("--top-k", type=int, default=ranking.RANKING_RETAIN_TOP_K, help="モードごとに残す上位件数")
+    p.add_argument("--days", type=int, default=ranking.RANKING_RETAIN_DAYS, help="この日数以内の記録は全て残す")
+    p.set_defaults(func=cmd_compact)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
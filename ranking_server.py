@@ -0,0 +1,278 @@
+"""
+ランキング用の Redis 互換 (RESP) サーバーの最小実装。開発・試験で Redis の代わりに使う。
+
+    python ranking_server.py --port 6379
+    RANKING_BACKEND=redis RANKING_URL=redis://127.0.0.1:6379/0 streamlit run mental_math_app.py
+
+ranking.py の RedisRankingStore が使うコマンドだけを実装している:
+PING, AUTH, SELECT, MULTI, EXEC, DISCARD, INCRBY, HSET, HMGET, HGETALL, ZADD, ZCARD, ZCOUNT, ZRANGE, DEL, FLUSHDB。
+データはメモリ上にしか置かないので、止めると消える。本番では Redis / Valkey を使うこと。
+"""
+import argparse
+import bisect
+import socketserver
+import threading
+import urllib.parse
+
+import ranking
+
+
+class SortedSet:
+    """(スコア, メンバー) の昇順リストとメンバー → スコアの辞書。Redis と同じく同点はメンバーの文字列順"""
+    def __init__(self):
+        self.scores = {}
+        self.entries = []
+
+    def add(self, member, score):
+        old = self.scores.get(member)
+        if old is not None:
+            del self.entries[bisect.bisect_left(self.entries, (old, member))]
+        self.scores[member] = score
+        bisect.insort(self.entries, (score, member))
+        return old is None
+
+    def count(self, lo, lo_open, hi, hi_open):
+        left = (bisect.bisect_right if lo_open else bisect.bisect_left)(self.entries, (lo, "" if not lo_open else "\U0010ffff"))
+        right = (bisect.bisect_left if hi_open else bisect.bisect_right)(self.entries, (hi, "\U0010ffff" if not hi_open else ""))
+        return max(0, right - left)
+
+    def range(self, start, stop):
+        n = len(self.entries)
+        start = max(0, start + n if start < 0 else start)
+        stop = stop + n if stop < 0 else min(stop, n - 1)
+        return [m for _, m in self.entries[start:stop + 1]] if start <= stop else []
+
+
+class Simple(str):
+    """+OK のような単純文字列の返信"""
+
+
+class CommandError(Exception):
+    pass
+
+
+def _parse_bound(text):
+    """ZCOUNT の範囲指定 ("-inf", "+inf", "(1.5", "2") を (値, 開区間か) にする"""
+    is_open = text.startswith("(")
+    text = text[1:] if is_open else text
+    try:
+        return float(text), is_open
+    except ValueError:
+        raise CommandError("min or max is not a float") from None
+
+
+class Store:
+    """データベース番号ごとの {キー: 文字列 / dict (ハッシュ) / SortedSet}。コマンドは1つのロックで直列に実行する"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dbs = {}
+
+    def _get(self, db, key, kind, create=False):
+        value = db.get(key)
+        if value is None:
+            if not create:
+                return None
+            value = db[key] = kind()
+        elif not isinstance(value, kind):
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _handler(self, args):
+        handler = getattr(self, "cmd_" + args[0].lower(), None)
+        if handler is None:
+            raise CommandError(f"unknown command '{args[0]}'")
+        return handler
+
+    def execute(self, session, args):
+        name = args[0].upper()
+        queued = session.get("multi")
+        if name == "MULTI":
+            if queued is not None:
+                raise CommandError("MULTI calls can not be nested")
+            session["multi"] = []
+            return Simple("OK")
+        if name == "DISCARD":
+            if session.pop("multi", None) is None:
+                raise CommandError("DISCARD without MULTI")
+            return Simple("OK")
+        if name == "EXEC":
+            if session.pop("multi", None) is None:
+                raise CommandError("EXEC without MULTI")
+            # キューのコマンドは1つのロックの中で続けて実行するので、途中の状態は他の接続から見えない
+            with self.lock:
+                replies = []
+                for handler, cmd_args in queued:
+                    try:
+                        replies.append(handler(session, self.dbs.setdefault(session["db"], {}), cmd_args))
+                    except (CommandError, ValueError, IndexError) as e:
+                        replies.append(e if isinstance(e, CommandError) else CommandError(f"syntax error: {e}"))
+                return replies
+        handler = self._handler(args)
+        if queued is not None:
+            queued.append((handler, args[1:]))
+            return Simple("QUEUED")
+        with self.lock:
+            db = self.dbs.setdefault(session["db"], {})
+            return handler(session, db, args[1:])
+
+    def cmd_ping(self, session, db, args):
+        return args[0] if args else Simple("PONG")
+
+    def cmd_auth(self, session, db, args):
+        return Simple("OK")
+
+    def cmd_select(self, session, db, args):
+        session["db"] = int(args[0])
+        return Simple("OK")
+
+    def cmd_flushdb(self, session, db, args):
+        db.clear()
+        return Simple("OK")
+
+    def cmd_del(self, session, db, args):
+        return sum(db.pop(k, None) is not None for k in args)
+
+    def cmd_incrby(self, session, db, args):
+        value = int(db.get(args[0], "0")) + int(args[1])
+        db[args[0]] = str(value)
+        return value
+
+    def cmd_hset(self, session, db, args):
+        if len(args) < 3 or len(args) % 2 == 0:
+            raise CommandError("wrong number of arguments for 'hset' command")
+        h = self._get(db, args[0], dict, create=True)
+        added = 0
+        for field, value in zip(args[1::2], args[2::2]):
+            added += field not in h
+            h[field] = value
+        return added
+
+    def cmd_hmget(self, session, db, args):
+        h = self._get(db, args[0], dict) or {}
+        return [h.get(f) for f in args[1:]]
+
+    def cmd_hgetall(self, session, db, args):
+        h = self._get(db, args[0], dict) or {}
+        return [x for item in h.items() for x in item]
+
+    def cmd_zadd(self, session, db, args):
+        if len(args) < 3 or len(args) % 2 == 0:
+            raise CommandError("wrong number of arguments for 'zadd' command")
+        z = self._get(db, args[0], SortedSet, create=True)
+        return sum(z.add(member, float(score)) for score, member in zip(args[1::2], args[2::2]))
+
+    def cmd_zcard(self, session, db, args):
+        z = self._get(db, args[0], SortedSet)
+        return len(z.scores) if z else 0
+
+    def cmd_zcount(self, session, db, args):
+        z = self._get(db, args[0], SortedSet)
+        return z.count(*_parse_bound(args[1]), *_parse_bound(args[2])) if z else 0
+
+    def cmd_zrange(self, session, db, args):
+        z = self._get(db, args[0], SortedSet)
+        return z.range(int(args[1]), int(args[2])) if z else []
+
+
+# ==========================================
+# プロトコル
+# ==========================================
+def encode(value):
+    if isinstance(value, CommandError):
+        msg = str(value)
+        return f"-{msg if msg.startswith('WRONGTYPE') else 'ERR ' + msg}\r\n".encode("utf-8")
+    if isinstance(value, Simple):
+        return f"+{value}\r\n".encode("utf-8")
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+    return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+
+
+def read_command(rfile):
+    """配列形式のコマンド (または redis-cli のインライン形式) を1つ読む。接続が閉じたら None"""
+    line = rfile.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.decode("utf-8").split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = rfile.readline()
+        if not header.startswith(b"$"):
+            raise ConnectionError("bulk string expected")
+        n = int(header[1:])
+        args.append(rfile.read(n + 2)[:-2].decode("utf-8"))
+    return args
+
+
+class Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True  # パイプラインの返信を1つずつ書くので、遅延 ACK 待ちを避ける
+
+    def handle(self):
+        session = {"db": 0}
+        while True:
+            try:
+                args = read_command(self.rfile)
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            if args[0].upper() == "QUIT":
+                self.wfile.write(encode(Simple("OK")))
+                return
+            try:
+                reply = self.server.store.execute(session, args)
+            except (CommandError, ValueError, IndexError) as e:
+                reply = e if isinstance(e, CommandError) else CommandError(f"syntax error: {e}")
+            self.wfile.write(encode(reply))
+            self.wfile.flush()
+
+
+class RankingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, Handler)
+        self.store = Store()
+
+
+def serve_in_thread(host="127.0.0.1", port=0):
+    """バックグラウンドのスレッドで起動して、サーバーを返す (port=0 なら空いているポート)。URL は server_url(server)"""
+    server = RankingServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server, db=0):
+    host, port = server.server_address[:2]
+    return f"redis://{host}:{port}/{db}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビジネス暗算道場 ランキングサーバー (Redis 互換の代用品)")
+    # 既定ではアプリの接続先 (RANKING_URL) で待ち受ける
+    default = urllib.parse.urlsplit(ranking.RANKING_URL)
+    parser.add_argument("--host", default=default.hostname or "127.0.0.1")
+    parser.add_argument("--port", type=int, default=default.port or 6379)
+    args = parser.parse_args(argv)
+
+    server = RankingServer((args.host, args.port))
+    print(f"{server_url(server)} で待ち受けています (Ctrl+C で停止)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
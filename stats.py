@@ -0,0 +1,287 @@
+"""
+解答記録 (1問ごと・列指向) と、パターン別・モード別・ニックネーム別の逐次集計。
+
+集計はプロセスに1つの ANSWER_STATS に足し、STATS_DIR にプロセスごとのスナップショットを書き出す。
+画面はそれらと他プロセスのスナップショットを合算して表示する。numpy は解答記録を読むときだけ読み込む。
+"""
+import atexit
+import json
+import math
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import streamlit as st
+
+from metrics import METRICS
+from ranking import file_lock
+
+ATTEMPT_DIR = os.environ.get("ATTEMPT_DIR", "attempts")  # 1問ごとの解答記録 (空文字で記録しない)
+STATS_DIR = os.environ.get("STATS_DIR", "stats")  # プロセスごとの統計スナップショット (空文字で書き出さない)
+STATS_SNAPSHOT_INTERVAL = 30  # 秒
+SKETCH_ACCURACY = 0.02  # 解答時間の分位点の相対誤差
+
+# ==========================================
+# 解答記録 (1問ごと・列指向)
+# ==========================================
+# 1列 = 1ファイルの固定長バイナリ (リトルエンディアン)。分析側は必要な列だけを
+# np.memmap で開けるので、数千万件になっても全体をメモリに読み込まずに済む。
+ATTEMPT_COLUMNS = (
+    ("ts", "<d"),        # 解答時刻 (UNIX 秒)
+    ("mode", "<B"),      # ATTEMPT_MODES の番号
+    ("pattern", "<B"),
+    ("val1", "<q"),
+    ("val2", "<q"),
+    ("pct", "<d"),
+    ("user", "<d"),      # 入力した値 / 選んだ選択肢
+    ("correct", "<d"),
+    ("diff_pct", "<d"),
+    ("elapsed", "<f"),   # 解答にかかった秒数
+    ("points", "<b"),    # チャレンジは獲得点、お気軽は正解なら 1
+)
+ATTEMPT_MODES = ("quiz", "quiz_advanced", "training", "training_advanced", "daily_quiz", "daily_training")
+
+def _attempt_path(directory, name):
+    return os.path.join(directory, f"{name}.bin")
+
+def record_attempt(page, q, user_val, diff_pct, points, elapsed, directory=None):
+    """
+    解答1件を各列のファイル末尾に追記する。全列をロック内で書くので行はずれないが、
+    途中で落ちて列の長さが揃わなかった場合は、次の追記の前に一番短い列に合わせて切り詰める。
+    """
+    directory = ATTEMPT_DIR if directory is None else directory
+    if not directory:
+        return
+    values = {
+        "ts": time.time(), "mode": ATTEMPT_MODES.index(page), "pattern": q["pattern"],
+        "val1": q["raw_val1"], "val2": q["raw_val2"], "pct": q["raw_pct"],
+        "user": user_val, "correct": q["correct"], "diff_pct": diff_pct,
+        "elapsed": elapsed, "points": points,
+    }
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(os.path.join(directory, "attempts.lock")):
+            sizes = {}
+            for name, fmt in ATTEMPT_COLUMNS:
+                try:
+                    sizes[name] = os.path.getsize(_attempt_path(directory, name))
+                except FileNotFoundError:
+                    sizes[name] = 0
+            n = min(sizes[name] // struct.calcsize(fmt) for name, fmt in ATTEMPT_COLUMNS)
+            for name, fmt in ATTEMPT_COLUMNS:
+                path = _attempt_path(directory, name)
+                if sizes[name] != n * struct.calcsize(fmt):  # 余分な行や書きかけのバイトを落とす
+                    os.truncate(path, n * struct.calcsize(fmt))
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+                try:
+                    os.write(fd, struct.pack(fmt, values[name]))
+                finally:
+                    os.close(fd)
+    except OSError as e:
+        # 記録は遊ぶのを邪魔しない (読み取り専用のディレクトリ・ディスクあふれなど)。途中で切れた行は次の追記で揃える
+        METRICS.inc("mental_math_attempt_write_errors_total")
+        print(f"解答記録を {directory} に書き込めませんでした ({type(e).__name__}: {e})", file=sys.stderr)
+
+def load_attempts(columns=None, directory=None):
+    """
+    解答記録を {列名: 読み取り専用の np.memmap} で返す。columns で列を絞れる。
+    書き込み中の行を拾わないよう、全列の件数の最小値までを返す。記録しない設定 (directory が空) なら0件。
+    """
+    import numpy as np
+    directory = ATTEMPT_DIR if directory is None else directory
+    fmts = dict(ATTEMPT_COLUMNS)
+    columns = list(fmts) if columns is None else list(columns)
+    counts = {}
+    for name, fmt in ATTEMPT_COLUMNS:
+        try:
+            counts[name] = os.path.getsize(_attempt_path(directory, name)) // struct.calcsize(fmt) if directory else 0
+        except FileNotFoundError:
+            counts[name] = 0
+    n = min(counts.values())
+    if n == 0:
+        return {name: np.empty(0, dtype=np.dtype(fmts[name])) for name in columns}
+    return {name: np.memmap(_attempt_path(directory, name), dtype=np.dtype(fmts[name]), mode="r", shape=(n,)) for name in columns}
+
+# ==========================================
+# 統計 (パターン別・モード別・ニックネーム別の逐次集計)
+# ==========================================
+class QuantileSketch:
+    """
+    対数バケットの分位点スケッチ (DDSketch と同じ考え方)。値 x を ceil(log_γ x) 番目の
+    バケットに数えるので、どの分位点も相対誤差 accuracy 以内で求まる。
+    バケットごとの件数を足すだけで、別のプロセスのスケッチと合算できる。
+    """
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        if x <= 0:
+            self.zeros += 1
+            return
+        i = math.ceil(math.log(x) / self.log_gamma)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError("精度の異なるスケッチは合算できません")
+        self.count += other.count
+        self.zeros += other.zeros
+        for i, c in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + c
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                return 2 * self.gamma ** i / (self.gamma + 1)  # バケット (γ^(i-1), γ^i] の代表値
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {"accuracy": self.accuracy, "zeros": self.zeros, "count": self.count, "buckets": list(self.buckets.items())}
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d["accuracy"])
+        sketch.zeros = d["zeros"]
+        sketch.count = d["count"]
+        sketch.buckets = {int(i): c for i, c in d["buckets"]}
+        return sketch
+
+class StatAggregate:
+    """件数・正解数・誤差% と解答時間の合計・解答時間のスケッチ。update は O(1)、merge で合算できる"""
+    def __init__(self):
+        self.count = 0
+        self.correct = 0
+        self.diff_sum = 0.0
+        self.time_sum = 0.0
+        self.times = QuantileSketch()
+
+    def update(self, diff_pct, correct, elapsed):
+        self.count += 1
+        self.correct += bool(correct)
+        self.diff_sum += diff_pct
+        self.time_sum += elapsed
+        self.times.add(elapsed)
+
+    def merge(self, other):
+        self.count += other.count
+        self.correct += other.correct
+        self.diff_sum += other.diff_sum
+        self.time_sum += other.time_sum
+        self.times.merge(other.times)
+
+    def summary(self):
+        n = self.count or 1
+        return {"件数": self.count, "正答率(%)": round(self.correct / n * 100, 1), "平均誤差(%)": round(self.diff_sum / n, 2),
+                "平均タイム(秒)": round(self.time_sum / n, 1),
+                "タイム p50": round(self.times.quantile(0.5) or 0, 1), "タイム p90": round(self.times.quantile(0.9) or 0, 1)}
+
+    def to_dict(self):
+        return {"count": self.count, "correct": self.correct, "diff_sum": self.diff_sum, "time_sum": self.time_sum, "times": self.times.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d):
+        agg = cls()
+        agg.count, agg.correct, agg.diff_sum, agg.time_sum = d["count"], d["correct"], d["diff_sum"], d["time_sum"]
+        agg.times = QuantileSketch.from_dict(d["times"])
+        return agg
+
+def write_stats_snapshot(stats, force=False):
+    """
+    このプロセスの集計を STATS_DIR/<プロセスID>.json に書き出す (STATS_SNAPSHOT_INTERVAL 秒に1回まで)。
+    集計の変換と書き込みは解答したセッションを待たせないよう別スレッドで行う (force なら呼び出し元で書く)。
+    """
+    if not STATS_DIR:
+        return
+    now = time.time()
+    with stats["lock"]:  # 同時に解答したセッションのうち1つだけが書き出しを始める
+        if not force and now - stats["last_snapshot"] < STATS_SNAPSHOT_INTERVAL:
+            return
+        stats["last_snapshot"] = now
+    if force:
+        _write_stats_snapshot(stats)
+    else:
+        threading.Thread(target=_write_stats_snapshot, args=(stats,), name="stats-snapshot", daemon=True).start()
+
+def _write_stats_snapshot(stats):
+    # 書き出しは1つずつ行い、集計はロックを取ってから読むので、後に置き換えたファイルほど新しい
+    with stats["write_lock"]:
+        now = time.time()
+        with stats["lock"]:
+            groups = [[kind, key, agg.to_dict()] for (kind, key), agg in stats["groups"].items()]
+        if not groups:
+            return
+        path = os.path.join(STATS_DIR, f"{stats['process_id']}.json")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(STATS_DIR, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"process_id": stats["process_id"], "written_at": now, "groups": groups}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            # 統計は解答の邪魔をしない。書けなければ次の機会 (または終了時) に回す
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+# このプロセスの集計。スナップショットのファイル名はプロセスごとに一意にする (pid は再起動で使い回されるため)
+ANSWER_STATS = {"lock": threading.Lock(), "write_lock": threading.Lock(), "groups": {}, "last_snapshot": 0.0,
+                "process_id": f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"}
+atexit.register(write_stats_snapshot, ANSWER_STATS, True)
+
+def add_answer_stats(page, pattern, diff_pct, correct, elapsed):
+    """解答1件をパターン別・モード別の集計に足す (ニックネーム別は登録時に足す)"""
+    stats = ANSWER_STATS
+    pattern = int(pattern)
+    with stats["lock"]:
+        for key in (("pattern", pattern), ("mode", page)):
+            stats["groups"].setdefault(key, StatAggregate()).update(diff_pct, correct, elapsed)
+    write_stats_snapshot(stats)
+
+def record_nickname_stats(nickname, session_stats):
+    stats = ANSWER_STATS
+    with stats["lock"]:
+        stats["groups"].setdefault(("nickname", nickname), StatAggregate()).merge(session_stats)
+    write_stats_snapshot(stats)
+
+@st.cache_data(ttl=STATS_SNAPSHOT_INTERVAL, show_spinner=False)
+def _load_stats_snapshots(directory, exclude_process_id):
+    snapshots = []
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if not name.endswith(".json") or name == f"{exclude_process_id}.json":
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                snapshots.append(json.load(f)["groups"])
+        except (OSError, ValueError, KeyError):
+            continue  # 書き換え中・壊れたファイルは次回に回す
+    return snapshots
+
+def merged_answer_stats():
+    """他プロセスのスナップショットとこのプロセスの最新の集計を合算して {(種類, キー): StatAggregate} で返す"""
+    stats = ANSWER_STATS
+    merged = {}
+    if STATS_DIR:
+        for groups in _load_stats_snapshots(STATS_DIR, stats["process_id"]):
+            for kind, key, d in groups:
+                merged.setdefault((kind, key), StatAggregate()).merge(StatAggregate.from_dict(d))
+    with stats["lock"]:
+        for key, agg in stats["groups"].items():
+            merged.setdefault(key, StatAggregate()).merge(agg)
+    return merged
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+import streamlit as st
+import streamlit.logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# st.* をスクリプト実行外で呼ぶと毎回警告が出るので抑える
+# (設定の読み込み時にログレベルが戻るので、先に読み込ませておく)
+st.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+import ranking  # noqa: E402
+import ranking_server  # noqa: E402
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    """tmp_path の CSV・SQLite と、スレッドで起動した ranking_server をそれぞれ使う3つのストア"""
+    server = ranking_server.serve_in_thread()
+    monkeypatch.setattr(ranking, "RANKING_FILE", str(tmp_path / "ranking.csv"))
+    monkeypatch.setattr(ranking, "RANKING_DB", str(tmp_path / "ranking.db"))
+    monkeypatch.setattr(ranking, "RANKING_URL", ranking_server.server_url(server))
+    ranking.invalidate_ranking_cache()
+    yield {b: ranking.ranking_store(b) for b in ("csv", "sqlite", "redis")}
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,20 @@
+import stats
+
+QUESTION = {"pattern": 1, "raw_val1": 1200, "raw_val2": 300, "raw_pct": 0, "correct": 360000}
+
+
+def test_record_and_load(tmp_path):
+    for i in range(3):
+        stats.record_attempt("training", QUESTION, 350000 + i, 2.5, 9, 4.0, directory=str(tmp_path))
+    cols = stats.load_attempts(["user", "points"], directory=str(tmp_path))
+    assert list(cols["user"]) == [350000, 350001, 350002]
+    assert list(cols["points"]) == [9, 9, 9]
+
+
+def test_write_failure_does_not_raise(tmp_path):
+    blocker = tmp_path / "not_a_dir"
+    blocker.write_text("")
+    key = ("mental_math_attempt_write_errors_total", ())
+    before = stats.METRICS.values.get(key, 0)
+    stats.record_attempt("quiz", QUESTION, 360000, 0.0, 1, 3.0, directory=str(blocker / "attempts"))
+    assert stats.METRICS.values.get(key, 0) == before + 1
@@ -0,0 +1,54 @@
+import csv
+import gzip
+from datetime import datetime, timedelta
+
+import ranking
+
+NOW = datetime(2024, 7, 1, 12, 0)
+
+
+def _write(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(ranking.RANKING_COLUMNS)
+        w.writerows(rows)
+
+
+def _read(path, opener=open):
+    with opener(path, "rt", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_past_daily_modes_are_archived(tmp_path):
+    rows = []
+    for d in range(200):
+        day = (NOW - timedelta(days=d)).strftime("%Y-%m-%d")
+        for page in ranking.DAILY_MODES:
+            for i in range(20):
+                rows.append([f"{day} 09:00", f"u{i}", ranking.daily_mode_name(page, day), i, 10.0 + i])
+    csv_path, archive = tmp_path / "ranking.csv", tmp_path / "archive.csv.gz"
+    _write(csv_path, rows)
+
+    result = ranking.compact_ranking(str(csv_path), str(archive), top_k=10, days=30, now=NOW)
+
+    kept = _read(csv_path)
+    cutoff_day = (NOW - timedelta(days=30)).strftime("%Y-%m-%d")
+    assert {r["mode"].rsplit(" ", 1)[1] for r in kept} == {
+        (NOW - timedelta(days=d)).strftime("%Y-%m-%d") for d in range(31)}
+    # 期間内の日は全件、境界の日 (09:00 は cutoff の 12:00 より前) は上位 10 件だけ
+    assert len(kept) == 2 * (30 * 20 + 10)
+    assert all(r["mode"].rsplit(" ", 1)[1] >= cutoff_day for r in kept)
+    assert result == {"kept": len(kept), "archived": len(rows) - len(kept), "dropped": 0}
+    assert len(_read(archive, gzip.open)) == result["archived"]
+
+
+def test_regular_modes_keep_top_k_forever(tmp_path):
+    old = (NOW - timedelta(days=365)).strftime("%Y-%m-%d %H:%M")
+    rows = [[old, f"u{i}", "お気軽(基礎)", i, 30.0] for i in range(50)]
+    csv_path, archive = tmp_path / "ranking.csv", tmp_path / "archive.csv.gz"
+    _write(csv_path, rows)
+
+    result = ranking.compact_ranking(str(csv_path), str(archive), top_k=10, days=30, now=NOW)
+
+    assert sorted(int(r["score"]) for r in _read(csv_path)) == list(range(40, 50))
+    assert result == {"kept": 10, "archived": 40, "dropped": 0}
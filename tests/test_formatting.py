@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import questions
+
+
+def test_unit_labels_keep_each_value_type():
+    values = [10000, 15000.0, 10000, 2.5, 300000000]
+    assert list(questions.format_unit_labels(values)) == [questions.format_number_with_unit_label(v) for v in values]
+    assert questions.format_unit_labels(values)[0] == "1万"
+
+
+def test_unit_labels_accept_arrays():
+    assert list(questions.format_unit_labels(np.array([10000, 123456789]))) == ["1万", "1.2億"]
+
+
+JAPANESE_ANSWER_VALUES = [0, 1, 9999, 10000, 12345678, 10**8, 123456789012, 10**12, 98765 * 10**12, 10**16, 12 * 10**17,
+                          -10000, -123456789, 2**63 - 1, -2**63]
+JAPANESE_ANSWER_FLOATS = [0.0, -0.0, 0.5, 9999.9, 10000.0, 12345678.9, 1e12, 9.9e15, 1e17, -2.5e8, float("nan"), float("inf")]
+
+
+def test_japanese_answers_match_scalar_version():
+    for values in (JAPANESE_ANSWER_VALUES, JAPANESE_ANSWER_FLOATS):
+        assert list(questions.format_japanese_answers(values)) == [questions.format_japanese_answer(v) for v in values]
+    series = pd.Series(JAPANESE_ANSWER_VALUES[:5], index=list("abcde"))
+    assert questions.format_japanese_answers(series).to_dict() == {k: questions.format_japanese_answer(v) for k, v in series.items()}
+
+
+def test_japanese_answers_accept_scalars():
+    for v in (0, 123456789, 1.5e9, np.int64(10**12), np.array(10000)):
+        assert questions.format_japanese_answers(v) == questions.format_japanese_answer(v.item() if hasattr(v, "item") else v)
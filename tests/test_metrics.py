@@ -0,0 +1,50 @@
+import threading
+import types
+
+import mental_math_app as app
+import metrics
+
+
+def test_flush_writes_file(tmp_path):
+    registry = metrics.MetricsRegistry(metrics.METRIC_DEFS)
+    registry.inc("mental_math_attempt_write_errors_total")
+    path = tmp_path / "metrics.prom"
+    registry.flush(str(path), force=True)
+    assert "mental_math_attempt_write_errors_total 1" in path.read_text(encoding="utf-8")
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.prom"]
+
+
+def test_flush_failure_does_not_raise(tmp_path):
+    registry = metrics.MetricsRegistry(metrics.METRIC_DEFS)
+    registry.flush(str(tmp_path / "missing" / "metrics.prom"), force=True)
+    assert registry.values[("mental_math_metrics_flush_errors_total", ())] == 1
+
+
+def test_concurrent_flush_writes_once_per_interval(tmp_path):
+    registry = metrics.MetricsRegistry(metrics.METRIC_DEFS)
+    registry.last_flush = 0
+    written = []
+    render = registry.render
+    registry.render = lambda: written.append(1) or render()
+    threads = [threading.Thread(target=registry.flush, args=(str(tmp_path / "metrics.prom"),)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(written) == 1
+
+
+def test_profile_write_failure_keeps_metrics(tmp_path, monkeypatch):
+    blocker = tmp_path / "not_a_dir"
+    blocker.write_text("")
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(blocker))
+    monkeypatch.setattr(metrics, "PROFILE_SAMPLE", 1.0)
+    ctx = types.SimpleNamespace(_enqueue=lambda msg: None)
+    monkeypatch.setattr(app, "get_script_run_ctx", lambda: ctx)
+    runs = ("mental_math_script_seconds", (("page", "test"), ("scope", "app")))
+    errors = ("mental_math_profile_write_errors_total", ())
+    before = metrics.METRICS.values.get(runs, [None, 0, 0])[2], metrics.METRICS.values.get(errors, 0)
+    with app.script_metrics("test", "app"):
+        pass
+    assert ctx._payload_counter["active"] is False
+    assert (metrics.METRICS.values[runs][2], metrics.METRICS.values[errors]) == (before[0] + 1, before[1] + 1)
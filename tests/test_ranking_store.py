@@ -0,0 +1,96 @@
+import random
+import sqlite3
+import threading
+
+import ranking
+
+MODES = ("お気軽(基礎)", "チャレンジ(上級)")
+
+
+def _rows(n, seed=0):
+    # 同点・同タイムや、ミリ秒未満だけ違うタイムを多めに混ぜる
+    rng = random.Random(seed)
+    durations = [10.0, 10.0002, 10.0004, 59.999, 60.0] + [rng.uniform(10, 300) for _ in range(20)]
+    return [{"timestamp": "2024-01-01 12:00", "nickname": f"u{i}", "mode": rng.choice(MODES),
+             "score": rng.randint(0, 10), "duration": rng.choice(durations)} for i in range(n)]
+
+
+def _key(rows):
+    return [(r["nickname"], int(r["score"]), float(r["duration"])) for r in rows]
+
+
+def test_backends_agree(stores):
+    rows = _rows(600)
+    for store in stores.values():
+        store.insert(rows[:300])
+        for row in rows[300:]:
+            store.insert([row])
+
+    for mode in (None,) + MODES:
+        counts = {b: s.count(mode) for b, s in stores.items()}
+        assert len(set(counts.values())) == 1, counts
+        for offset in (0, 17, 250):
+            pages = {b: _key(s.top(mode, 40, offset)) for b, s in stores.items()}
+            assert pages["csv"] == pages["sqlite"] == pages["redis"], (mode, offset)
+
+    for mode in MODES:
+        for score in range(11):
+            for duration in (10.0, 10.0001, 10.0002, 10.0003, 60.0, 0.5, 500.0):
+                positions = {b: s.position(mode, score, duration) for b, s in stores.items()}
+                assert len(set(positions.values())) == 1, (mode, score, duration, positions)
+
+
+def test_own_row_is_not_counted_as_better(stores):
+    for store in stores.values():
+        store.insert([{"timestamp": "2024-01-01 12:00", "nickname": "me", "mode": MODES[0], "score": 5, "duration": 10.0002}])
+        assert store.position(MODES[0], 5, 10.0002) == (1, 1)
+
+
+def test_migrate_skips_non_empty_store(stores, tmp_path):
+    import csv
+    path = tmp_path / "src.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, ranking.RANKING_COLUMNS)
+        w.writeheader()
+        w.writerows(_rows(50, seed=1))
+    assert ranking.migrate_ranking_csv(str(path), "sqlite") == 50
+    assert ranking.migrate_ranking_csv(str(path), "sqlite") == 0
+    assert ranking.migrate_ranking_csv(str(path), "redis") == 50
+    assert _key(stores["sqlite"].top(None, None)) == _key(stores["redis"].top(None, None))
+
+
+def test_csv_reads_do_not_wait_for_file_lock(stores):
+    store = stores["csv"]
+    store.insert(_rows(10))
+    assert store.count() == 10
+    with ranking.ranking_lock():  # 別プロセスの追記や compact_ranking がロックを持っている状態
+        writer = threading.Thread(target=store.insert, args=(_rows(1, seed=2),))
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        reader = threading.Thread(target=lambda: (store.count(), store.top(MODES[0], 5), store.position(MODES[0], 5, 10.0)))
+        reader.start()
+        reader.join(5)
+        assert not reader.is_alive()
+    writer.join(5)
+    assert store.count() == 11
+
+
+def test_sqlite_counts_are_backfilled_for_existing_db(tmp_path, monkeypatch):
+    # 件数表を足す前の版で作った DB
+    path = tmp_path / "old.db"
+    rows = _rows(200, seed=3)
+    conn = sqlite3.connect(path)
+    conn.executescript(ranking.SQLITE_SCHEMA)
+    conn.executemany("INSERT INTO ranking (timestamp, nickname, mode, score, duration) VALUES (?, ?, ?, ?, ?)",
+                     [tuple(r[c] for c in ranking.RANKING_COLUMNS) for r in rows])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(ranking, "RANKING_DB", str(path))
+    store = ranking.ranking_store("sqlite")
+    store.insert(_rows(5, seed=4))
+    assert store.count() == 205
+    for mode in MODES:
+        expected = sum(r["mode"] == mode for r in rows + _rows(5, seed=4))
+        assert store.count(mode) == expected
+        assert store.position(mode, -1, 0.0) == (expected + 1, expected)
@@ -0,0 +1,76 @@
+import pytest
+
+import ranking
+
+MODE = "チャレンジ(基礎)"
+
+
+def _row(i):
+    return {"timestamp": "2024-01-01 12:00", "nickname": f"u{i}", "mode": MODE, "score": i % 11, "duration": 10.0 + i}
+
+
+@pytest.fixture
+def writer():
+    writer = ranking.RankingWriter()
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+def _record_batches(monkeypatch, store):
+    batches = []
+    insert = store.insert
+    monkeypatch.setattr(store, "insert", lambda rows: batches.append(len(rows)) or insert(rows))
+    return batches
+
+
+@pytest.mark.parametrize("backend", ["csv", "redis"])
+def test_stop_drains_pending_rows(stores, writer, backend):
+    store = stores[backend]
+    for i in range(200):
+        assert writer.submit(store, _row(i)) is not None
+    writer.stop()
+    assert not writer.is_alive()
+    assert store.count(MODE) == 200
+
+
+def test_rows_submitted_together_are_committed_together(stores, writer, monkeypatch):
+    store = stores["csv"]
+    batches = _record_batches(monkeypatch, store)
+    with writer.cond:  # 書き込み用のスレッドが取り出す前に全部入れる
+        for i in range(50):
+            writer.submit(store, _row(i))
+    assert writer.flush(5)
+    assert batches == [50]
+    assert store.count(MODE) == 50
+
+
+def test_failed_batch_is_retried(stores, writer, monkeypatch):
+    store = stores["csv"]
+    insert = store.insert
+    calls = []
+
+    def flaky_insert(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        insert(rows)
+
+    monkeypatch.setattr(store, "insert", flaky_insert)
+    key = ("mental_math_ranking_write_errors_total", ())
+    before = ranking.METRICS.values.get(key, 0)
+    writer.submit(store, _row(1))
+    assert writer.flush(5)
+    assert calls == [1, 1]
+    assert ranking.METRICS.values.get(key, 0) == before + 1
+    assert [r["nickname"] for r in store.top(MODE)] == ["u1"]
+
+
+def test_submit_after_stop_is_written_synchronously(stores, writer, monkeypatch):
+    writer.stop()
+    assert writer.submit(stores["csv"], _row(1)) is None
+    monkeypatch.setattr(ranking, "RANKING_BACKEND", "csv")
+    monkeypatch.setattr(ranking, "RANKING_ASYNC", True)
+    monkeypatch.setattr(ranking, "_ranking_writer", lambda: writer)
+    assert ranking.submit_ranking("late", MODE, 7, 12.5) == (1, 1)
+    assert [r["nickname"] for r in stores["csv"].top(MODE)] == ["late"]
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from streamlit.runtime.scriptrunner import script_runner
+from streamlit.testing.v1 import AppTest
+
+import ranking
+import stats
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mental_math_app.py")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """ranking.csv などを tmp_path に書き、スクリプトの実行回数を runs["n"] に数える AppTest"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ranking, "RANKING_FILE", str(tmp_path / "ranking.csv"))
+    monkeypatch.setattr(ranking, "RANKING_ASYNC", False)
+    monkeypatch.setattr(stats, "ATTEMPT_DIR", "")
+    monkeypatch.setattr(stats, "STATS_DIR", "")
+    runs = {"n": 0}
+    exec_func = script_runner.exec_func_with_error_handling
+
+    # st.rerun() による再実行も、フラグメントだけの再実行も1回ずつ数える
+    def counting_exec_func(*args, **kwargs):
+        runs["n"] += 1
+        return exec_func(*args, **kwargs)
+
+    monkeypatch.setattr(script_runner, "exec_func_with_error_handling", counting_exec_func)
+    at = AppTest.from_file(APP, default_timeout=30)
+    at.run()
+    assert not at.exception
+    return at, runs
+
+
+def runs_for(at, runs, action):
+    """action (ウィジェット操作 → run) 1回で何回スクリプトが実行されたか"""
+    runs["n"] = 0
+    action()
+    assert not at.exception, at.exception
+    return runs["n"]
+
+
+def button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def test_quiz_flow_runs_once_per_action(app):
+    at, runs = app
+    assert runs_for(at, runs, lambda: at.button(key="quiz_adv_btn").click().run()) == 1
+    while True:
+        choice = next(b for b in at.button if b.key and "_opt_" in b.key)
+        assert runs_for(at, runs, lambda: choice.click().run()) == 1
+        if not any(b.label == "次の問題へ" for b in at.button):
+            break
+        assert runs_for(at, runs, lambda: button(at, "次の問題へ").click().run()) == 1
+        if any(b.label == "登録する" for b in at.button):
+            break
+    at.text_input(key="ranking_nickname").input("tester")
+    assert runs_for(at, runs, lambda: button(at, "登録する").click().run()) == 1
+    assert any("ランキングに登録しました" in s.value for s in at.success)
+    assert runs_for(at, runs, lambda: button(at, "トップに戻る").click().run()) == 1
+    assert at.button(key="quiz_adv_btn")
+
+
+def test_training_flow_runs_once_per_action(app):
+    at, runs = app
+    assert runs_for(at, runs, lambda: at.button(key="train_basic_btn").click().run()) == 1
+    assert runs_for(at, runs, lambda: button(at, "答え合わせ").click().run()) == 1
+    assert runs_for(at, runs, lambda: button(at, "次の問題へ").click().run()) == 1
+    assert runs_for(at, runs, lambda: button(at, "トップに戻る（中断）").click().run()) == 1
+    assert at.button(key="train_basic_btn")
@@ -0,0 +1,57 @@
+import random
+
+import numpy as np
+
+import questions
+import stats
+
+
+def _pairs():
+    # 各しきい値ちょうど・そのすぐ内側と外側、正解が 0・負・大きな値 (2**53 未満) を含める
+    pairs = []
+    for correct in (100, 250, 3_000_000, 123_456_789, 2**51, -4000):
+        for pct in (0,) + questions.SCORE_THRESHOLDS + (25, 100, 1000):
+            for sign in (1, -1):
+                user = correct + sign * correct * pct // 100
+                pairs += [(user, correct), (user + 1, correct), (user - 1, correct)]
+        for ratio in (0.99, 1.01, 0.98999, 1.01001):
+            pairs.append((round(correct * ratio), correct))
+    pairs += [(0, 0), (5, 0), (0, 100), (-100, 100)]
+    rng = random.Random(0)
+    for _ in range(5000):
+        correct = rng.randint(1, 10**13)
+        pairs.append((int(correct * rng.uniform(0.7, 1.3)), correct))
+    return pairs
+
+
+def test_batch_scores_match_scalar():
+    user, correct = map(list, zip(*_pairs()))
+    points, diff_pct, is_perfect = questions.calculate_scores(user, correct)
+    expected = [questions.calculate_score(u, c) for u, c in zip(user, correct)]
+    assert points.tolist() == [e[0] for e in expected]
+    assert diff_pct.tolist() == [e[1] for e in expected]
+    assert is_perfect.tolist() == [e[2] for e in expected]
+
+
+def test_batch_choices_match_scalar():
+    user, correct = map(list, zip(*_pairs()))
+    assert questions.judge_choices(user, correct).tolist() == [questions.is_choice_correct(u, c) for u, c in zip(user, correct)]
+
+
+def test_threshold_boundaries():
+    points, _, _ = questions.calculate_scores([102, 103, 120, 121, 100], [100] * 5)
+    assert points.tolist() == [10, 9, 1, 0, 10]
+    assert questions.judge_choices([99, 101, 98, 102], [100] * 4).tolist() == [True, True, False, False]
+
+
+def test_regrade_attempts(tmp_path):
+    q = {"pattern": 1, "raw_val1": 1200, "raw_val2": 300, "raw_pct": 0, "correct": 360000}
+    for user in (360000, 370000, 400000):
+        points, diff_pct, _ = questions.calculate_score(user, q["correct"])
+        stats.record_attempt("training", q, user, diff_pct, points, 3.0, directory=str(tmp_path))
+        correct = questions.is_choice_correct(user, q["correct"])
+        stats.record_attempt("quiz", q, user, diff_pct, int(correct), 3.0, directory=str(tmp_path))
+    rows = {r["mode"]: r for r in questions.regrade_attempts(str(tmp_path))}
+    assert rows["training"]["count"] == 3 and rows["training"]["changed"] == 0
+    assert np.isclose(rows["training"]["regraded"], (10 + 9 + 5) / 3)
+    assert np.isclose(rows["quiz"]["regraded"], 1 / 3)
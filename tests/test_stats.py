@@ -0,0 +1,47 @@
+import json
+import threading
+
+import pytest
+
+import stats
+
+
+@pytest.fixture
+def process_stats(tmp_path, monkeypatch):
+    monkeypatch.setattr(stats, "STATS_DIR", str(tmp_path))
+    process_stats = {"lock": threading.Lock(), "write_lock": threading.Lock(), "groups": {}, "last_snapshot": 0.0, "process_id": "test"}
+    for i in range(3):
+        process_stats["groups"][("nickname", f"u{i}")] = agg = stats.StatAggregate()
+        agg.update(1.5, True, 4.0 + i)
+    return process_stats
+
+
+def _join_snapshot_threads():
+    for t in threading.enumerate():
+        if t.name == "stats-snapshot":
+            t.join(5)
+
+
+def test_concurrent_snapshots_start_one_write_off_the_caller_thread(process_stats, tmp_path, monkeypatch):
+    callers = set()
+    to_dict = stats.StatAggregate.to_dict
+    monkeypatch.setattr(stats.StatAggregate, "to_dict", lambda self: callers.add(threading.current_thread().name) or to_dict(self))
+    threads = [threading.Thread(target=stats.write_stats_snapshot, args=(process_stats,)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    _join_snapshot_threads()
+    assert callers == {"stats-snapshot"}
+    assert [p.name for p in tmp_path.iterdir()] == ["test.json"]
+    snapshot = json.loads((tmp_path / "test.json").read_text(encoding="utf-8"))
+    assert len(snapshot["groups"]) == 3
+
+
+def test_forced_snapshot_writes_latest_groups(process_stats, tmp_path):
+    stats.write_stats_snapshot(process_stats)
+    _join_snapshot_threads()
+    process_stats["groups"][("pattern", 1)] = stats.StatAggregate()
+    stats.write_stats_snapshot(process_stats, force=True)
+    snapshot = json.loads((tmp_path / "test.json").read_text(encoding="utf-8"))
+    assert len(snapshot["groups"]) == 4